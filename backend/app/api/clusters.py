@@ -37,10 +37,7 @@ async def get_cluster(
     db: AsyncSession = Depends(get_db),
 ):
     """Get a specific cluster by ID."""
-    result = await db.execute(
-        select(Cluster).where(Cluster.id == cluster_id)
-    )
-    cluster = result.scalar_one_or_none()
+    cluster = await photo_service.get_cluster(db, cluster_id)
     
     if not cluster:
         raise HTTPException(status_code=404, detail="Cluster not found")
@@ -55,10 +52,7 @@ async def update_cluster(
     db: AsyncSession = Depends(get_db),
 ):
     """Update cluster name (assign a name to a person)."""
-    result = await db.execute(
-        select(Cluster).where(Cluster.id == cluster_id)
-    )
-    cluster = result.scalar_one_or_none()
+    cluster = await photo_service.get_cluster(db, cluster_id)
     
     if not cluster:
         raise HTTPException(status_code=404, detail="Cluster not found")
@@ -66,15 +60,8 @@ async def update_cluster(
     cluster.name = update.name
     await db.commit()
     
-    # Reload with relationships
-    from sqlalchemy.orm import selectinload
-    result = await db.execute(
-        select(Cluster)
-        .options(selectinload(Cluster.faces))
-        .where(Cluster.id == cluster_id)
-    )
-    cluster = result.scalar_one()
-    
+    # Faces were eagerly loaded above and sessions don't expire on commit,
+    # so no reload is needed here
     return ClusterResponse(**cluster.to_dict())
 
 
@@ -86,7 +73,7 @@ async def get_cluster_photos(
 ):
     """Get all photos containing faces from this cluster (person)."""
     photos = await search_service.search_by_person(db, cluster_id, limit)
-    return [PhotoResponse(**p.to_dict()) for p in photos]
+    return await photo_service.photo_dicts(db, photos)
 
 
 @router.post("/{cluster_id}/merge/{other_cluster_id}")
@@ -115,6 +102,7 @@ async def merge_clusters(
         raise HTTPException(status_code=404, detail="Source cluster not found")
     
     merged_id = await clustering_service.merge_clusters(db, cluster_id, other_cluster_id)
+    await db.commit()
     
     return {"success": True, "merged_cluster_id": merged_id}
 
@@ -160,10 +148,10 @@ async def trigger_reclustering(
     """
     await clustering_service.recluster_all(db)
     
-    clusters = await photo_service.get_clusters(db)
+    stats = await photo_service.get_stats(db)
     
     return {
         "success": True,
         "message": "Reclustering complete",
-        "cluster_count": len(clusters),
+        "cluster_count": stats.total_people,
     }
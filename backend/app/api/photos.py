@@ -1,26 +1,84 @@
 """
 Smart Gallery Backend - Photos API Routes
 """
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
-from fastapi.responses import Response, StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, Request
+from fastapi.responses import Response, FileResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
-import aiofiles
+from typing import Any, Dict, List, Optional
+import asyncio
 import logging
+import orjson
+import os
 
-from app.core.database import get_db
+from app.core.database import get_db, AsyncSessionLocal
 from app.core.config import settings
 from app.models.schemas import PhotoResponse, PhotoUpdate, UploadResponse
 from app.services.photo_service import photo_service
+from app.utils.image import get_mime_type
+from app.utils.upload import read_upload
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/photos", tags=["Photos"])
 
+IMAGE_CACHE_CONTROL = "public, max-age=31536000"
+
+# Joined per request, so keep them as plain strings
+PHOTOS_DIR = str(settings.photos_dir)
+THUMBNAILS_DIR = str(settings.thumbnails_dir)
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """Check a request's If-None-Match header against an ETag."""
+    if_none_match = request.headers.get("if-none-match")
+    return bool(if_none_match) and etag in [tag.strip() for tag in if_none_match.split(",")]
+
+
+def _not_modified(etag: str) -> Response:
+    """Empty 304 response for a cached file."""
+    return Response(
+        status_code=304,
+        headers={"Cache-Control": IMAGE_CACHE_CONTROL, "ETag": etag},
+    )
+
+
+def _file_response(
+    request: Request,
+    path: str,
+    media_type: str,
+    filename: Optional[str] = None,
+    etag: Optional[str] = None,
+) -> Response:
+    """
+    Serve a file from disk, answering conditional requests with 304.
+    
+    Without a stored ETag one is derived from the file's mtime and size,
+    so stat() is the only I/O needed to revalidate a cached image.
+    FileResponse streams the body in chunks instead of loading it into
+    memory.
+    
+    Raises FileNotFoundError if the file is missing.
+    """
+    stat_result = os.stat(path)
+    if etag is None:
+        etag = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+    headers = {"Cache-Control": IMAGE_CACHE_CONTROL, "ETag": etag}
+    
+    if _etag_matches(request, etag):
+        return _not_modified(etag)
+    
+    return FileResponse(
+        path,
+        media_type=media_type,
+        filename=filename,
+        content_disposition_type="inline",
+        headers=headers,
+        stat_result=stat_result,
+    )
+
 
 @router.post("/upload", response_model=UploadResponse)
 async def upload_photos(
     files: List[UploadFile] = File(..., description="Image files to upload"),
-    db: AsyncSession = Depends(get_db),
 ):
     """
     Upload one or more photos for processing.
@@ -34,51 +92,52 @@ async def upload_photos(
     if not files:
         raise HTTPException(status_code=400, detail="No files provided")
     
-    processed_photos = []
-    errors = []
+    semaphore = asyncio.Semaphore(settings.upload_concurrency)
     
-    for file in files:
-        try:
-            # Validate file type
-            if not file.content_type or not file.content_type.startswith("image/"):
-                errors.append({
-                    "filename": file.filename,
-                    "error": "Invalid file type. Only images are allowed."
-                })
-                continue
-            
-            # Read file content
-            content = await file.read()
-            
-            if len(content) > 50 * 1024 * 1024:  # 50MB limit
-                errors.append({
+    async def process_file(file: UploadFile) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                # Validate file type
+                if not file.content_type or not file.content_type.startswith("image/"):
+                    return {"error": {
+                        "filename": file.filename,
+                        "error": "Invalid file type. Only images are allowed."
+                    }}
+                
+                # Read file content, stopping early if it is too large
+                content = await read_upload(file, settings.max_upload_size)
+                
+                # Process and save, each file in its own session so one
+                # failed commit can't poison the others
+                async with AsyncSessionLocal() as db:
+                    photo = await photo_service.process_and_save_photo(
+                        db=db,
+                        file_content=content,
+                        original_filename=file.filename or "unknown.jpg",
+                    )
+                
+                logger.info(f"Processed photo: {file.filename}")
+                return {"photo": photo.cached_json}
+                
+            except Exception as e:
+                logger.error(f"Error processing {file.filename}: {e}")
+                return {"error": {
                     "filename": file.filename,
-                    "error": "File too large. Maximum size is 50MB."
-                })
-                continue
-            
-            # Process and save
-            photo = await photo_service.process_and_save_photo(
-                db=db,
-                file_content=content,
-                original_filename=file.filename or "unknown.jpg",
-            )
-            
-            processed_photos.append(PhotoResponse(**photo.to_dict()))
-            logger.info(f"Processed photo: {file.filename}")
-            
-        except Exception as e:
-            logger.error(f"Error processing {file.filename}: {e}")
-            errors.append({
-                "filename": file.filename,
-                "error": str(e)
-            })
-    
-    return UploadResponse(
-        success=len(processed_photos) > 0,
-        photos=processed_photos,
-        errors=errors,
-    )
+                    "error": str(e)
+                }}
+    
+    # Files are decoded and run through the models concurrently (only the
+    # database phase is serialized); results keep the upload order
+    outcomes = await asyncio.gather(*(process_file(f) for f in files))
+    
+    processed_photos = [o["photo"] for o in outcomes if "photo" in o]
+    errors = [o["error"] for o in outcomes if "error" in o]
+    
+    return {
+        "success": len(processed_photos) > 0,
+        "photos": processed_photos,
+        "errors": errors,
+    }
 
 
 @router.get("", response_model=List[PhotoResponse])
@@ -88,8 +147,25 @@ async def list_photos(
     db: AsyncSession = Depends(get_db),
 ):
     """Get all photos with pagination."""
-    photos = await photo_service.get_all_photos(db)
-    return [PhotoResponse(**p.to_dict()) for p in photos[skip:skip + limit]]
+    photos = await photo_service.list_photos(db, skip=skip, limit=limit)
+    return await photo_service.photo_dicts(db, photos)
+
+
+@router.get("/stream")
+async def stream_photos():
+    """
+    Stream all photos, newest first, as JSON lines (application/x-ndjson).
+    
+    Rows are read and sent in batches, so memory doesn't grow with the
+    gallery size.
+    """
+    async def lines():
+        # Own session: dependencies are torn down before the body streams
+        async with AsyncSessionLocal() as db:
+            async for photo in photo_service.iter_photo_dicts(db):
+                yield orjson.dumps(photo) + b"\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
 @router.get("/{photo_id}", response_model=PhotoResponse)
@@ -101,7 +177,7 @@ async def get_photo(
     photo = await photo_service.get_photo(db, photo_id)
     if not photo:
         raise HTTPException(status_code=404, detail="Photo not found")
-    return PhotoResponse(**photo.to_dict())
+    return photo.to_dict()
 
 
 @router.delete("/{photo_id}")
@@ -119,58 +195,67 @@ async def delete_photo(
 @router.get("/{photo_id}/image")
 async def get_photo_image(
     photo_id: str,
+    request: Request,
     db: AsyncSession = Depends(get_db),
 ):
     """Get the full-size photo image."""
-    photo = await photo_service.get_photo(db, photo_id)
+    photo = await photo_service.get_photo_file(db, photo_id)
     if not photo:
         raise HTTPException(status_code=404, detail="Photo not found")
     
-    photo_path = settings.photos_dir / photo.filename
-    if not photo_path.exists():
-        raise HTTPException(status_code=404, detail="Image file not found")
-    
-    async with aiofiles.open(photo_path, 'rb') as f:
-        content = await f.read()
+    # Content-hash ETag: revalidation needs no disk access at all
+    etag = f'"{photo.etag}"' if photo.etag else None
+    if etag and _etag_matches(request, etag):
+        return _not_modified(etag)
     
-    return Response(
-        content=content,
-        media_type=photo.mime_type,
-        headers={
-            "Cache-Control": "public, max-age=31536000",
-            "Content-Disposition": f'inline; filename="{photo.original_filename}"',
-        }
-    )
+    try:
+        return _file_response(
+            request,
+            os.path.join(PHOTOS_DIR, photo.filename),
+            media_type=photo.mime_type,
+            filename=photo.original_filename,
+            etag=etag,
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image file not found")
 
 
 @router.get("/{photo_id}/thumbnail")
 async def get_photo_thumbnail(
     photo_id: str,
+    request: Request,
     db: AsyncSession = Depends(get_db),
 ):
     """Get the photo thumbnail."""
-    photo = await photo_service.get_photo(db, photo_id)
+    photo = await photo_service.get_photo_file(db, photo_id)
     if not photo:
         raise HTTPException(status_code=404, detail="Photo not found")
     
-    thumbnail_path = settings.thumbnails_dir / photo.filename
-    if not thumbnail_path.exists():
-        # Fall back to full image
-        thumbnail_path = settings.photos_dir / photo.filename
+    etag = f'"{photo.etag}-thumb"' if photo.etag else None
+    if etag and _etag_matches(request, etag):
+        return _not_modified(etag)
     
-    if not thumbnail_path.exists():
-        raise HTTPException(status_code=404, detail="Thumbnail not found")
-    
-    async with aiofiles.open(thumbnail_path, 'rb') as f:
-        content = await f.read()
+    # Older photos have a thumbnail with the same name and format as the photo
+    thumbnail_filename = photo.thumbnail_filename or photo.filename
+    try:
+        return _file_response(
+            request,
+            os.path.join(THUMBNAILS_DIR, thumbnail_filename),
+            media_type=get_mime_type(thumbnail_filename),
+            etag=etag,
+        )
+    except FileNotFoundError:
+        pass
     
-    return Response(
-        content=content,
-        media_type=photo.mime_type,
-        headers={
-            "Cache-Control": "public, max-age=31536000",
-        }
-    )
+    # Fall back to full image, validated by mtime/size instead
+    try:
+        return _file_response(
+            request,
+            os.path.join(PHOTOS_DIR, photo.filename),
+            media_type=photo.mime_type,
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
 
 
 @router.patch("/{photo_id}", response_model=PhotoResponse)
@@ -187,7 +272,7 @@ async def update_photo(
     if update.is_favorite is not None:
         photo = await photo_service.update_favorite(db, photo_id, update.is_favorite)
     
-    return PhotoResponse(**photo.to_dict())
+    return photo.to_dict()
 
 
 @router.get("/{photo_id}/similar", response_model=List[dict])
@@ -199,12 +284,4 @@ async def get_similar_photos(
     """Find photos similar to the given photo using CLIP embeddings."""
     from app.services.search_service import search_service
     
-    results = await search_service.find_similar_photos(db, photo_id, limit)
-    return [
-        {
-            "photo": r.photo.model_dump(),
-            "similarity": r.similarity,
-            "match_type": r.match_type,
-        }
-        for r in results
-    ]
+    return await search_service.find_similar_photos(db, photo_id, limit)
@@ -7,8 +7,11 @@ from typing import List
 import logging
 
 from app.core.database import get_db
-from app.models.schemas import SearchResponse, SearchResult, PhotoResponse
+from app.core.config import settings
+from app.models.schemas import SearchResponse, PhotoResponse
+from app.services.photo_service import photo_service
 from app.services.search_service import search_service
+from app.utils.upload import read_upload
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/search", tags=["Search"])
@@ -35,11 +38,7 @@ async def search_by_text(
     """
     results = await search_service.search_by_text(db, q, limit)
     
-    return SearchResponse(
-        results=results,
-        query=q,
-        total=len(results),
-    )
+    return {"results": results, "query": q, "total": len(results)}
 
 
 @router.post("/image", response_model=SearchResponse)
@@ -57,18 +56,14 @@ async def search_by_image(
     if not file.content_type or not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="Invalid file type. Only images allowed.")
     
-    content = await file.read()
-    
-    if len(content) > 10 * 1024 * 1024:  # 10MB limit for search
-        raise HTTPException(status_code=400, detail="File too large. Maximum 10MB.")
+    try:
+        content = await read_upload(file, settings.max_search_upload_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     results = await search_service.search_by_image(db, content, limit)
     
-    return SearchResponse(
-        results=results,
-        query=f"image:{file.filename}",
-        total=len(results),
-    )
+    return {"results": results, "query": f"image:{file.filename}", "total": len(results)}
 
 
 @router.get("/face/{face_id}", response_model=SearchResponse)
@@ -85,11 +80,7 @@ async def search_by_face(
     """
     results = await search_service.search_by_face(db, face_id, limit)
     
-    return SearchResponse(
-        results=results,
-        query=f"face:{face_id}",
-        total=len(results),
-    )
+    return {"results": results, "query": f"face:{face_id}", "total": len(results)}
 
 
 @router.get("/person/{cluster_id}", response_model=List[PhotoResponse])
@@ -105,7 +96,7 @@ async def search_by_person(
     face clustering.
     """
     photos = await search_service.search_by_person(db, cluster_id, limit)
-    return [PhotoResponse(**p.to_dict()) for p in photos]
+    return await photo_service.photo_dicts(db, photos)
 
 
 @router.get("/object/{class_name}", response_model=List[PhotoResponse])
@@ -133,4 +124,4 @@ async def search_by_object(
     - book, clock, vase, scissors, teddy bear, hair drier, toothbrush
     """
     photos = await search_service.search_by_object(db, class_name, min_confidence, limit)
-    return [PhotoResponse(**p.to_dict()) for p in photos]
+    return await photo_service.photo_dicts(db, photos)
@@ -3,6 +3,7 @@ Smart Gallery Backend - Configuration
 """
 from pydantic_settings import BaseSettings
 from pydantic import Field
+from functools import cached_property
 from pathlib import Path
 from typing import Optional
 import os
@@ -22,20 +23,50 @@ class Settings(BaseSettings):
     
     # ML Settings
     device: str = "cuda"  # cuda or cpu
+    half_precision: bool = True  # fp16 CLIP/YOLO inference on CUDA
     yolo_model_path: Optional[str] = None
     yolo_confidence: float = 0.25
     face_det_thresh: float = 0.5
     face_sim_thresh: float = 0.6
     clip_model: str = "ViT-L-14"
     clip_pretrained: str = "openai"
+    text_embedding_cache_size: int = 4096  # cached CLIP text queries
+    clip_batch_size: int = 16  # max images per coalesced CLIP forward pass
+    clip_batch_wait_ms: float = 8.0  # how long to wait to fill a batch (all models)
+    detection_batch_size: int = 8  # max images per coalesced YOLO/face batch
+    compile_models: bool = False  # torch.compile CLIP (slow startup, faster inference)
+    
+    # Vector Search
+    clip_index_type: str = "hnsw"  # flat (exact) or hnsw (approximate)
+    face_index_type: str = "hnsw"  # same, for the face index
+    hnsw_m: int = 32  # graph neighbors per node
+    hnsw_ef_construction: int = 200
+    hnsw_ef_search: int = 64
+    embedding_precision: str = "fp16"  # fp32, fp16 or int8 index storage
+    face_embedding_precision: str = "int8"  # same, for the face index
+    faiss_gpu: bool = False  # search flat fp32 indices on the GPU (needs faiss-gpu)
+    search_batch_size: int = 32  # max concurrent CLIP searches run as one batch
+    search_batch_wait_ms: float = 5.0  # how long to wait to fill a search batch
+    index_snapshot_interval: int = 300  # seconds between full index saves
     
     # Image Processing
     thumbnail_size: tuple = (400, 400)
+    thumbnail_format: str = "webp"  # webp (smaller) or jpg
     max_image_size: int = 4096
     jpeg_quality: int = 85
     
-    # CORS
-    cors_origins: list = ["*"]
+    # Uploads
+    upload_concurrency: int = 4  # files processed in parallel per request
+    max_upload_size: int = 50 * 1024 * 1024  # bytes
+    max_search_upload_size: int = 10 * 1024 * 1024  # bytes, query images
+    
+    # Database
+    db_pool_size: int = 5  # pooled SQLite connections kept open
+    db_max_overflow: int = 10  # extra connections allowed under bursts
+    db_query_cache_size: int = 1200  # compiled SQL statements cached per engine
+    
+    # CORS (frontend origins; set CORS_ORIGINS as a JSON list)
+    cors_origins: list = ["http://localhost:3000", "http://127.0.0.1:3000"]
     
     class Config:
         env_file = ".env"
@@ -45,25 +76,25 @@ class Settings(BaseSettings):
     def base_dir(self) -> Path:
         return Path(__file__).parent.parent.parent
     
-    @property
+    @cached_property
     def data_dir(self) -> Path:
         path = self.base_dir / "data"
         path.mkdir(parents=True, exist_ok=True)
         return path
     
-    @property
+    @cached_property
     def photos_dir(self) -> Path:
         path = self.data_dir / "photos"
         path.mkdir(parents=True, exist_ok=True)
         return path
     
-    @property
+    @cached_property
     def thumbnails_dir(self) -> Path:
         path = self.data_dir / "thumbnails"
         path.mkdir(parents=True, exist_ok=True)
         return path
     
-    @property
+    @cached_property
     def embeddings_dir(self) -> Path:
         path = self.data_dir / "embeddings"
         path.mkdir(parents=True, exist_ok=True)
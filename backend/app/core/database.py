@@ -1,13 +1,17 @@
 """
 Smart Gallery Backend - Database Connection
 """
+from sqlalchemy import event, inspect, select, func, insert, delete
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 
 from app.core.config import settings
-from app.models.database import Base
+from app.models.database import (
+    Base, Photo, Face, Cluster, Detection, Stats, CategoryStats, STATS_ROW_ID
+)
 
 
 # Create async engine
@@ -15,8 +19,35 @@ engine = create_async_engine(
     settings.database_url,
     echo=settings.debug,
     future=True,
+    connect_args={"timeout": 30},  # wait for the writer instead of failing fast
+    # Keep connections (and their pragmas) warm across requests. aiosqlite
+    # defaults to NullPool for file databases, so ask for a queue pool; a
+    # local SQLite file can't go stale, so skip the pre-ping round trip
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_pre_ping=False,
+    query_cache_size=settings.db_query_cache_size,
+)
+
+# Per-connection SQLite tuning: WAL lets reads proceed during writes
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",  # 256MB
+    "PRAGMA cache_size=-65536",  # 64MB
+    "PRAGMA temp_store=MEMORY",
 )
 
+
+@event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply SQLite pragmas to every new connection."""
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
 # Create async session factory
 AsyncSessionLocal = async_sessionmaker(
     engine,
@@ -27,23 +58,62 @@ AsyncSessionLocal = async_sessionmaker(
 )
 
 
+def _add_missing_columns(conn):
+    """Add columns and indexes introduced after a table was first created."""
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=conn.dialect)
+                conn.exec_driver_sql(
+                    f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                )
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def _seed_stats(conn):
+    """Fill the stats tables from the data if they haven't been yet."""
+    if conn.execute(select(Stats.id)).first() is not None:
+        return
+    
+    def count(column):
+        return conn.execute(select(func.count(column))).scalar() or 0
+    
+    conn.execute(insert(Stats).values(
+        id=STATS_ROW_ID,
+        photo_count=count(Photo.id),
+        face_count=count(Face.id),
+        cluster_count=count(Cluster.id),
+        detection_count=count(Detection.id),
+        storage_used=conn.execute(select(func.sum(Photo.file_size))).scalar() or 0,
+    ))
+    
+    conn.execute(delete(CategoryStats))
+    conn.execute(insert(CategoryStats).from_select(
+        ["class_name", "count"],
+        select(Detection.class_name, func.count(Detection.id)).group_by(Detection.class_name),
+    ))
+
+
 async def init_db():
     """Initialize database tables."""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_seed_stats)
 
 
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
-    """Dependency for getting database sessions."""
+    """
+    Dependency for getting database sessions.
+    
+    Endpoints commit their own writes; anything left uncommitted is rolled
+    back when the session closes, so read-only requests skip the COMMIT.
+    """
     async with AsyncSessionLocal() as session:
-        try:
-            yield session
-            await session.commit()
-        except Exception:
-            await session.rollback()
-            raise
-        finally:
-            await session.close()
+        yield session
 
 
 @asynccontextmanager
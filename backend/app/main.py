@@ -4,15 +4,19 @@ Production-ready FastAPI application with AI-powered photo analysis.
 """
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, HTMLResponse
-from contextlib import asynccontextmanager
+from fastapi.responses import JSONResponse, HTMLResponse, ORJSONResponse
+from contextlib import asynccontextmanager, suppress
+import asyncio
 import logging
 import time
 
 from app.core.config import settings
-from app.core.database import init_db
+from app.core.database import init_db, engine, get_db_context
 from app.services.ml_service import ml_service
 from app.services.vector_service import vector_service
+from app.services.search_service import search_service
+from app.services.photo_service import photo_service
+from app.utils.image import jpeg_backend
 from app.api import photos, clusters, search, categories
 
 # Configure logging
@@ -23,6 +27,13 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+async def snapshot_indices():
+    """Periodically save the vector indices, folding in their journals."""
+    while True:
+        await asyncio.sleep(settings.index_snapshot_interval)
+        await asyncio.to_thread(vector_service.save_all)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan handler for startup and shutdown."""
@@ -35,23 +46,46 @@ async def lifespan(app: FastAPI):
     logger.info("📦 Initializing database...")
     await init_db()
     
+    # Caches are only written on the write paths; fill any left empty by
+    # older versions so reads don't keep rebuilding them
+    async with get_db_context() as db:
+        await photo_service.fill_photo_cache(db)
+    
+    logger.info(f"🖼️ JPEG codec: {jpeg_backend()}")
+    
     # Initialize ML models
     logger.info("🤖 Loading ML models...")
     await ml_service.initialize()
+    await ml_service.warmup()
     
     logger.info("=" * 50)
     logger.info("✅ Smart Gallery API is ready!")
     logger.info(f"📍 Running on http://{settings.host}:{settings.port}")
     logger.info("=" * 50)
     
+    snapshot_task = asyncio.create_task(snapshot_indices())
+    
     yield
     
     # Shutdown
     logger.info("🛑 Shutting down Smart Gallery API...")
     
+    # Stop the batching workers; anything still queued fails instead of
+    # hanging
+    await search_service.close()
+    await ml_service.close()
+    
+    snapshot_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await snapshot_task
+    
     # Save vector indices
     vector_service.save_all()
     
+    # Close pooled connections; their aiosqlite threads would keep the
+    # process alive
+    await engine.dispose()
+    
     logger.info("👋 Goodbye!")
 
 
@@ -87,12 +121,13 @@ AI-powered photo gallery backend with:
     docs_url="/docs",
     redoc_url="/redoc",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=settings.cors_origins,
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"],
     allow_headers=["*"],
@@ -100,16 +135,18 @@ app.add_middleware(
 )
 
 
-# Request timing middleware
-@app.middleware("http")
+# Request timing middleware (debug only; uvicorn's access log covers production)
 async def add_process_time_header(request: Request, call_next):
-    start_time = time.time()
+    start_time = time.perf_counter()
     response = await call_next(request)
-    process_time = time.time() - start_time
-    response.headers["X-Process-Time"] = str(process_time)
+    response.headers["X-Process-Time"] = f"{time.perf_counter() - start_time:.6f}"
     return response
 
 
+if settings.debug:
+    app.middleware("http")(add_process_time_header)
+
+
 # Include routers
 app.include_router(photos.router)
 app.include_router(clusters.router)
@@ -117,11 +154,8 @@ app.include_router(search.router)
 app.include_router(categories.router)
 
 
-# Root endpoint
-@app.get("/", response_class=HTMLResponse)
-async def root():
-    """Root endpoint with API information."""
-    html = f"""
+# Root page, rendered once at import since it only changes between deploys
+_ROOT_HTML: bytes = f"""
     <!DOCTYPE html>
     <html>
     <head>
@@ -256,8 +290,17 @@ async def root():
         </div>
     </body>
     </html>
-    """
-    return HTMLResponse(content=html)
+    """.encode("utf-8")
+
+
+# Root endpoint
+@app.get("/", response_class=HTMLResponse)
+async def root():
+    """Root endpoint with API information."""
+    return HTMLResponse(
+        content=_ROOT_HTML,
+        headers={"Cache-Control": "public, max-age=300"},
+    )
 
 
 # Health check
@@ -271,7 +314,8 @@ async def health_check():
             "yolo": ml_service.yolo_model is not None,
             "insightface": ml_service.face_app is not None,
             "clip": ml_service.clip_model is not None,
-        }
+        },
+        "text_embedding_cache": search_service.text_cache_info(),
     }
 
 
@@ -1,8 +1,10 @@
 """
 Smart Gallery Backend - Database Models
 """
-from sqlalchemy import Column, String, Integer, Float, DateTime, Text, ForeignKey, LargeBinary, Boolean, JSON
-from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy import Column, String, Integer, Float, DateTime, Text, ForeignKey, LargeBinary, Boolean, JSON, Index, event, text, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, relationship, declarative_base
 from sqlalchemy.sql import func
 from datetime import datetime
 import uuid
@@ -17,10 +19,18 @@ def generate_uuid():
 class Photo(Base):
     """Photo model storing image metadata and AI analysis results."""
     __tablename__ = "photos"
+    __table_args__ = (
+        # Matches the newest-first listing order, so pages and keyset
+        # batches are index range scans instead of a full sort
+        Index("ix_photos_upload_date_id", text("upload_date DESC"), "id"),
+        # Exact-duplicate lookups in search-by-image
+        Index("ix_photos_etag", "etag"),
+    )
     
     id = Column(String(36), primary_key=True, default=generate_uuid)
     filename = Column(String(255), nullable=False, unique=True)
     original_filename = Column(String(255), nullable=False)
+    thumbnail_filename = Column(String(255))  # NULL: same as filename (older photos)
     
     # File info
     file_size = Column(Integer, nullable=False)
@@ -39,16 +49,28 @@ class Photo(Base):
     processed = Column(Boolean, default=False)
     processing_error = Column(Text)
     
+    # SHA-256 of the uploaded file, used as the HTTP ETag and to find
+    # exact duplicates
+    etag = Column(String(64))
+    
     # CLIP embedding stored as binary (numpy array bytes)
     clip_embedding = Column(LargeBinary)
     
-    # Relationships
-    detections = relationship("Detection", back_populates="photo", cascade="all, delete-orphan")
-    faces = relationship("Face", back_populates="photo", cascade="all, delete-orphan")
+    # Relationships (lazy loading can't work under asyncio, so make a
+    # forgotten selectinload() fail loudly instead of with MissingGreenlet)
+    detections = relationship(
+        "Detection", back_populates="photo", cascade="all, delete-orphan", lazy="raise"
+    )
+    faces = relationship(
+        "Face", back_populates="photo", cascade="all, delete-orphan", lazy="raise"
+    )
     
     # Favorites
     is_favorite = Column(Boolean, default=False)
     
+    # Snapshot of to_dict() for list endpoints; NULL when stale
+    cached_json = Column(JSON)
+    
     def to_dict(self):
         return {
             "id": self.id,
@@ -70,9 +92,13 @@ class Photo(Base):
 class Detection(Base):
     """YOLO object detection results."""
     __tablename__ = "detections"
+    __table_args__ = (
+        # Covers the per-class GROUP BY in get_categories and class lookups
+        Index("ix_det_class_photo", "class_name", "photo_id"),
+    )
     
     id = Column(String(36), primary_key=True, default=generate_uuid)
-    photo_id = Column(String(36), ForeignKey("photos.id", ondelete="CASCADE"), nullable=False)
+    photo_id = Column(String(36), ForeignKey("photos.id", ondelete="CASCADE"), nullable=False, index=True)
     
     # Detection info
     class_name = Column(String(100), nullable=False)
@@ -106,8 +132,8 @@ class Face(Base):
     __tablename__ = "faces"
     
     id = Column(String(36), primary_key=True, default=generate_uuid)
-    photo_id = Column(String(36), ForeignKey("photos.id", ondelete="CASCADE"), nullable=False)
-    cluster_id = Column(String(36), ForeignKey("clusters.id", ondelete="SET NULL"))
+    photo_id = Column(String(36), ForeignKey("photos.id", ondelete="CASCADE"), nullable=False, index=True)
+    cluster_id = Column(String(36), ForeignKey("clusters.id", ondelete="SET NULL"), index=True)
     
     # Detection info
     confidence = Column(Float, nullable=False)
@@ -152,9 +178,6 @@ class Cluster(Base):
     id = Column(String(36), primary_key=True, default=generate_uuid)
     name = Column(String(100))  # User-assigned name
     
-    # Representative face embedding (average or centroid)
-    centroid_embedding = Column(LargeBinary)
-    
     # Representative photo for display
     representative_photo_id = Column(String(36))
     
@@ -162,8 +185,9 @@ class Cluster(Base):
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     
-    # Relationships
-    faces = relationship("Face", back_populates="cluster")
+    # Relationships (faces are always moved off a cluster before it is
+    # deleted, so deletes needn't load them)
+    faces = relationship("Face", back_populates="cluster", lazy="raise", passive_deletes=True)
     
     def to_dict(self):
         return {
@@ -173,3 +197,82 @@ class Cluster(Base):
             "representative_photo_id": self.representative_photo_id,
             "photo_ids": list(set(f.photo_id for f in self.faces)),
         }
+
+
+class Stats(Base):
+    """Running gallery totals (a single row), kept current by a flush event."""
+    __tablename__ = "stats"
+    
+    id = Column(Integer, primary_key=True)
+    photo_count = Column(Integer, nullable=False, default=0)
+    face_count = Column(Integer, nullable=False, default=0)
+    cluster_count = Column(Integer, nullable=False, default=0)
+    detection_count = Column(Integer, nullable=False, default=0)
+    storage_used = Column(Integer, nullable=False, default=0)
+
+
+class CategoryStats(Base):
+    """Running detection count per object class."""
+    __tablename__ = "category_stats"
+    
+    class_name = Column(String(100), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+STATS_ROW_ID = 1
+
+
+_UPSERTS = {"sqlite": sqlite_insert, "postgresql": postgresql_insert}
+
+
+@event.listens_for(Session, "after_flush")
+def _update_stats(session, flush_context):
+    """
+    Fold a flush's inserts and deletes into the running totals.
+    
+    session.new and session.deleted still hold what was just flushed, so
+    their deltas are summed here and written with one UPDATE of the stats
+    row plus one multi-row upsert of the category counts per flush,
+    however many rows it touched.
+    """
+    deltas = {}
+    categories = {}
+    
+    def tally(objects, sign):
+        for obj in objects:
+            if isinstance(obj, Photo):
+                deltas["photo_count"] = deltas.get("photo_count", 0) + sign
+                deltas["storage_used"] = deltas.get("storage_used", 0) + sign * (obj.file_size or 0)
+            elif isinstance(obj, Face):
+                deltas["face_count"] = deltas.get("face_count", 0) + sign
+            elif isinstance(obj, Cluster):
+                deltas["cluster_count"] = deltas.get("cluster_count", 0) + sign
+            elif isinstance(obj, Detection):
+                deltas["detection_count"] = deltas.get("detection_count", 0) + sign
+                categories[obj.class_name] = categories.get(obj.class_name, 0) + sign
+    
+    tally(session.new, 1)
+    tally(session.deleted, -1)
+    
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    categories = {name: delta for name, delta in categories.items() if delta}
+    if not deltas and not categories:
+        return
+    
+    connection = session.connection()
+    if deltas:
+        connection.execute(
+            update(Stats)
+            .where(Stats.id == STATS_ROW_ID)
+            .values({name: getattr(Stats, name) + delta for name, delta in deltas.items()})
+        )
+    if categories:
+        upsert = _UPSERTS[connection.dialect.name](CategoryStats).values(
+            [{"class_name": name, "count": delta} for name, delta in categories.items()]
+        )
+        connection.execute(
+            upsert.on_conflict_do_update(
+                index_elements=[CategoryStats.class_name],
+                set_={"count": CategoryStats.count + upsert.excluded["count"]},
+            )
+        )
@@ -132,7 +132,7 @@ class ImageSearchRequest(BaseModel):
 class SearchResult(BaseModel):
     photo: PhotoResponse
     similarity: float
-    match_type: str  # 'semantic', 'face', 'object'
+    match_type: str  # 'semantic', 'exact', 'face', 'object'
 
 
 class SearchResponse(BaseModel):
@@ -3,18 +3,68 @@ Smart Gallery Backend - Face Clustering Service
 Groups detected faces into clusters representing individuals.
 """
 import numpy as np
+import asyncio
 from typing import List, Dict, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update
 from sqlalchemy.orm import selectinload
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 import logging
 
-from app.models.database import Face, Cluster, Photo
+from app.models.database import Face, Cluster, generate_uuid
 from app.core.config import settings
 from app.services.vector_service import vector_service
+from app.utils.embedding import from_blobs
 
 logger = logging.getLogger(__name__)
 
+# Rows fetched per round trip when streaming faces for reclustering
+RECLUSTER_CHUNK_SIZE = 2000
+
+
+def threshold_components(
+    embeddings: np.ndarray,
+    threshold: float,
+    block_size: int = 1024,
+) -> np.ndarray:
+    """
+    Label embeddings by connected component of their similarity graph.
+    
+    Two embeddings are connected when their cosine similarity is at least
+    threshold. Similarities are computed block-wise as matrix products
+    against the embeddings not yet visited (each pair once), and each
+    block's edges are folded into the running component labels before
+    the next block, so memory stays O(block_size x N) however large a
+    component gets.
+    
+    Returns:
+        Component label per embedding, numbered from 0
+    """
+    normed = embeddings.astype(np.float32)
+    norms = np.linalg.norm(normed, axis=1, keepdims=True)
+    normed = normed / np.maximum(norms, 1e-12)
+    
+    n = len(normed)
+    labels = np.arange(n)
+    for start in range(0, n, block_size):
+        r, c = np.nonzero(normed[start:start + block_size] @ normed[start:].T >= threshold)
+        upper = c > r
+        # Edges between components already joined add nothing
+        r, c = labels[r[upper] + start], labels[c[upper] + start]
+        joins = r != c
+        if not joins.any():
+            continue
+        
+        graph = coo_matrix(
+            (np.ones(int(joins.sum()), dtype=np.int8), (r[joins], c[joins])), shape=(n, n)
+        )
+        _, merged = connected_components(graph, directed=False)
+        labels = merged[labels]
+    
+    _, labels = np.unique(labels, return_inverse=True)
+    return labels
+
 
 class ClusteringService:
     """Service for clustering faces into person groups."""
@@ -39,96 +89,95 @@ class ClusteringService:
         Returns:
             Cluster ID
         """
-        # Search for similar faces (get more results to filter)
-        similar_faces = vector_service.search_by_face(embedding, k=20)
+        cluster_ids = await self.assign_faces_batch(db, [face], embedding.reshape(1, -1))
+        return cluster_ids[0]
+    
+    async def assign_faces_batch(
+        self,
+        db: AsyncSession,
+        faces: List[Face],
+        embeddings: np.ndarray,
+    ) -> List[str]:
+        """
+        Assign several new faces to clusters with one index search.
         
-        # Filter out the current face (it was just added to the index)
-        similar_faces = [(fid, sim) for fid, sim in similar_faces if fid != face.id]
+        The faces must already be in the face index. Candidate clusters of
+        existing faces come from a single query; faces earlier in the batch
+        count as candidates for later ones, exactly as if they had been
+        assigned one by one. Only cluster_id is set on the faces, so it can
+        be written with the faces' own INSERT.
         
-        if not similar_faces:
-            # Create new cluster
-            return await self._create_cluster(db, face, embedding)
+        Args:
+            db: Database session
+            faces: Face objects to assign
+            embeddings: Their embeddings, shape (len(faces), dim)
+            
+        Returns:
+            Cluster ID per face
+        """
+        # Search for similar faces (get more results to filter)
+        hits = await asyncio.to_thread(vector_service.search_by_faces, embeddings, 20)
         
-        # Find the best matching cluster
-        best_cluster_id = None
-        best_similarity = 0.0
+        # Candidates above the threshold, skipping similarity = 1.0
+        # (likely duplicates or self)
+        candidates = [
+            [
+                (face_id, similarity) for face_id, similarity in similar_faces
+                if face_id != face.id and self.similarity_threshold <= similarity < 0.9999
+            ]
+            for face, similar_faces in zip(faces, hits)
+        ]
         
-        for face_id, similarity in similar_faces:
-            if similarity < self.similarity_threshold:
-                continue
+        # Look up all candidate clusters in one query; faces from this
+        # batch are filled in below as they're assigned
+        batch_ids = {face.id for face in faces}
+        lookup = {
+            face_id for face_candidates in candidates for face_id, _ in face_candidates
+        } - batch_ids
+        cluster_ids = {}
+        if lookup:
+            result = await db.execute(
+                select(Face.id, Face.cluster_id).where(Face.id.in_(lookup))
+            )
+            cluster_ids = dict(result.all())
+        
+        assigned = []
+        for face, face_candidates in zip(faces, candidates):
+            # Hits are sorted by similarity, so the first clustered one is best
+            best = next(
+                ((face_id, similarity) for face_id, similarity in face_candidates
+                 if cluster_ids.get(face_id)),
+                None,
+            )
             
-            # Skip faces with similarity = 1.0 (likely duplicates or self)
-            if similarity >= 0.9999:
-                continue
+            if best:
+                # Assign to existing cluster
+                face.cluster_id = cluster_ids[best[0]]
+                logger.debug(f"Assigned face {face.id} to cluster {face.cluster_id} (sim={best[1]:.3f})")
+            else:
+                # Create new cluster
+                await self._create_cluster(db, face)
             
-            # Get the face's cluster
-            try:
-                result = await db.execute(
-                    select(Face.cluster_id).where(Face.id == face_id)
-                )
-                cluster_id = result.scalar_one_or_none()
-                
-                if cluster_id and similarity > best_similarity:
-                    best_cluster_id = cluster_id
-                    best_similarity = similarity
-            except Exception as e:
-                logger.warning(f"Could not get cluster for face {face_id}: {e}")
-                continue
-        
-        if best_cluster_id:
-            # Assign to existing cluster
-            face.cluster_id = best_cluster_id
-            # Don't update centroid here - do it after commit to avoid async issues
-            logger.debug(f"Assigned face {face.id} to cluster {best_cluster_id} (sim={best_similarity:.3f})")
-            return best_cluster_id
-        else:
-            # Create new cluster
-            return await self._create_cluster(db, face, embedding)
+            cluster_ids[face.id] = face.cluster_id
+            assigned.append(face.cluster_id)
+        
+        return assigned
     
-    async def _create_cluster(
-        self, 
-        db: AsyncSession, 
-        face: Face, 
-        embedding: np.ndarray
-    ) -> str:
+    async def _create_cluster(self, db: AsyncSession, face: Face) -> str:
         """Create a new cluster for a face."""
-        cluster = Cluster(
-            centroid_embedding=embedding.tobytes(),
-            representative_photo_id=face.photo_id,
-        )
+        cluster = Cluster(id=generate_uuid(), representative_photo_id=face.photo_id)
         db.add(cluster)
-        await db.flush()
-        
         face.cluster_id = cluster.id
         
         logger.debug(f"Created new cluster {cluster.id} for face {face.id}")
         return cluster.id
     
-    async def _update_cluster_centroid(self, db: AsyncSession, cluster_id: str):
-        """Update cluster centroid based on all faces in cluster."""
-        result = await db.execute(
-            select(Face).where(Face.cluster_id == cluster_id)
-        )
-        faces = result.scalars().all()
+    async def _refresh_photo_cache(self, db: AsyncSession, photo_ids):
+        """Rebuild the cached dicts of photos whose faces changed cluster."""
+        # photo_service imports this module, so import it at call time
+        from app.services.photo_service import photo_service
         
-        if not faces:
-            return
-        
-        # Calculate new centroid
-        embeddings = []
-        for face in faces:
-            if face.embedding:
-                embeddings.append(np.frombuffer(face.embedding, dtype=np.float32))
-        
-        if embeddings:
-            centroid = np.mean(embeddings, axis=0).astype(np.float32)
-            
-            # Update cluster
-            await db.execute(
-                update(Cluster)
-                .where(Cluster.id == cluster_id)
-                .values(centroid_embedding=centroid.tobytes())
-            )
+        await photo_service.refresh_photo_cache(db, photo_ids)
     
     async def recluster_all(self, db: AsyncSession):
         """
@@ -137,36 +186,72 @@ class ClusteringService:
         """
         logger.info("Starting full face reclustering...")
         
-        # Get all faces with embeddings
-        result = await db.execute(
-            select(Face).where(Face.embedding.isnot(None))
+        # Stream the face embeddings as plain rows in chunks, decoding each
+        # chunk into one array so the raw blobs never pile up
+        face_ids, photo_ids, chunks = [], [], []
+        result = await db.stream(
+            select(Face.id, Face.photo_id, Face.embedding)
+            .where(Face.embedding.isnot(None))
+            .execution_options(yield_per=RECLUSTER_CHUNK_SIZE)
         )
-        faces = result.scalars().all()
+        async for rows in result.partitions():
+            chunk_ids, chunk_photo_ids, blobs = zip(*rows)
+            face_ids.extend(chunk_ids)
+            photo_ids.extend(chunk_photo_ids)
+            chunks.append(from_blobs(blobs))
         
-        if not faces:
+        if not face_ids:
             logger.info("No faces to cluster")
             return
         
+        # Every photo with faces changes: the faces with embeddings get new
+        # clusters and any others lose theirs
+        result = await db.execute(select(Face.photo_id).distinct())
+        changed_photo_ids = result.scalars().all()
+        
         # Clear existing clusters
         await db.execute(update(Face).values(cluster_id=None))
         result = await db.execute(select(Cluster))
         for cluster in result.scalars().all():
             await db.delete(cluster)
         
-        # Rebuild face index
-        vector_service.face_index.index = None
-        vector_service.face_index._load_or_create()
+        # Single-linkage clustering: connected components of the graph of
+        # face pairs above the similarity threshold
+        raw = np.concatenate(chunks)
+        del chunks
+        labels = threshold_components(raw, self.similarity_threshold)
+        
+        # One cluster per component, shown with its first face's photo
+        _, first = np.unique(labels, return_index=True)
+        clusters = [
+            Cluster(id=generate_uuid(), representative_photo_id=photo_ids[index])
+            for index in first
+        ]
+        db.add_all(clusters)
+        await db.flush()
+        
+        # Bulk UPDATE by primary key (one executemany)
+        await db.execute(
+            update(Face),
+            [
+                {"id": face_id, "cluster_id": clusters[label].id}
+                for face_id, label in zip(face_ids, labels)
+            ],
+        )
+        
+        await self._refresh_photo_cache(db, changed_photo_ids)
         
-        # Re-add all embeddings and cluster
-        for face in faces:
-            embedding = np.frombuffer(face.embedding, dtype=np.float32)
-            vector_service.add_face_embedding(face.id, embedding)
-            await self.assign_face_to_cluster(db, face, embedding)
+        # Rebuild face index in one batch (raw isn't needed afterwards, so
+        # it's normalized in place instead of copied)
+        await asyncio.to_thread(vector_service.face_index.reset, face_ids, raw, copy=False)
         
         await db.commit()
-        vector_service.save_all()
+        # The journal now holds every face vector; snapshot to fold it in
+        await asyncio.to_thread(vector_service.save_all)
         
-        logger.info(f"Reclustering complete: {len(faces)} faces processed")
+        logger.info(
+            f"Reclustering complete: {len(face_ids)} faces in {len(clusters)} clusters"
+        )
     
     async def merge_clusters(
         self, 
@@ -176,11 +261,16 @@ class ClusteringService:
     ) -> str:
         """Merge two clusters into one."""
         # Move all faces from cluster 2 to cluster 1
+        result = await db.execute(
+            select(Face.photo_id).where(Face.cluster_id == cluster_id_2).distinct()
+        )
+        changed_photo_ids = result.scalars().all()
         await db.execute(
             update(Face)
             .where(Face.cluster_id == cluster_id_2)
             .values(cluster_id=cluster_id_1)
         )
+        await self._refresh_photo_cache(db, changed_photo_ids)
         
         # Delete cluster 2
         result = await db.execute(
@@ -190,9 +280,6 @@ class ClusteringService:
         if cluster_2:
             await db.delete(cluster_2)
         
-        # Update cluster 1 centroid
-        await self._update_cluster_centroid(db, cluster_id_1)
-        
         logger.info(f"Merged cluster {cluster_id_2} into {cluster_id_1}")
         return cluster_id_1
     
@@ -210,15 +297,9 @@ class ClusteringService:
         if not face or not face.embedding:
             raise ValueError(f"Face {face_id} not found or has no embedding")
         
-        old_cluster_id = face.cluster_id
-        embedding = np.frombuffer(face.embedding, dtype=np.float32)
-        
         # Create new cluster
-        new_cluster_id = await self._create_cluster(db, face, embedding)
-        
-        # Update old cluster centroid
-        if old_cluster_id:
-            await self._update_cluster_centroid(db, old_cluster_id)
+        new_cluster_id = await self._create_cluster(db, face)
+        await self._refresh_photo_cache(db, [face.photo_id])
         
         return new_cluster_id
     
@@ -4,18 +4,22 @@ Handles photo CRUD operations and processing pipeline.
 """
 import numpy as np
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete, func
+from sqlalchemy import select, delete, func, and_, or_, bindparam
 from sqlalchemy.orm import selectinload
+import asyncio
+import hashlib
 import logging
 import aiofiles
 import os
 
-from app.models.database import Photo, Detection, Face, Cluster
+from app.models.database import (
+    Photo, Detection, Face, Cluster, Stats, CategoryStats, STATS_ROW_ID, generate_uuid
+)
 from app.models.schemas import PhotoResponse, GalleryStats, CategoryResponse
 from app.core.config import settings
-from app.services.ml_service import ml_service
+from app.services.ml_service import ml_service, BatchedEncoder
 from app.services.vector_service import vector_service
 from app.services.clustering_service import clustering_service
 from app.utils.image import (
@@ -23,13 +27,30 @@ from app.utils.image import (
     generate_filename, extract_exif, get_taken_date,
     get_image_dimensions, get_mime_type
 )
+from app.utils.embedding import to_blob
 
 logger = logging.getLogger(__name__)
 
+# Hot-path statements built once; the expanding "ids" parameter keeps one
+# compiled-cache entry whatever the number of IDs
+PHOTO_JSON_BY_IDS = select(Photo.id, Photo.cached_json).where(
+    Photo.id.in_(bindparam("ids", expanding=True))
+)
+PHOTOS_BY_IDS = select(Photo).where(Photo.id.in_(bindparam("ids", expanding=True)))
+
+# Photos whose cached dict is rebuilt per query on write paths
+CACHE_REFRESH_CHUNK_SIZE = 500
+
 
 class PhotoService:
     """Service for photo operations."""
     
+    def __init__(self):
+        # Uploads are processed concurrently, each in its own session, but
+        # face clustering must see earlier uploads' committed faces;
+        # serialize the DB phase.
+        self._write_lock = asyncio.Lock()
+    
     async def process_and_save_photo(
         self,
         db: AsyncSession,
@@ -39,6 +60,10 @@ class PhotoService:
         """
         Process an uploaded photo through the ML pipeline and save it.
         
+        ML inference runs in worker threads, batched across concurrent
+        uploads, so it doesn't block the event loop; database writes are
+        serialized.
+        
         Args:
             db: Database session
             file_content: Raw image bytes
@@ -47,132 +72,183 @@ class PhotoService:
         Returns:
             Created Photo object
         """
-        # Generate unique filename
-        filename = generate_filename(original_filename, file_content)
+        # Hash once (SHA-256 is hardware accelerated on modern CPUs) for
+        # both the filename and the ETag; hashlib releases the GIL
+        content_hash = (await asyncio.to_thread(hashlib.sha256, file_content)).hexdigest()
         
-        # Load and prepare image
-        image = load_image(file_content)
-        image = resize_image(image)  # Resize if too large
+        # Generate unique filename; the thumbnail gets its own format
+        filename = generate_filename(original_filename, content_hash)
+        thumbnail_filename = f"{Path(filename).stem}.{settings.thumbnail_format}"
+        
+        # Decode, resize and read EXIF off the event loop
+        image, exif_data = await asyncio.to_thread(self._prepare_image, file_content)
         
         # Get dimensions
         width, height = get_image_dimensions(image)
         
-        # Extract EXIF data
-        exif_data = extract_exif(file_content)
         taken_date = get_taken_date(exif_data)
         
-        # Create photo record
-        photo = Photo(
-            filename=filename,
-            original_filename=original_filename,
-            file_size=len(file_content),
-            mime_type=get_mime_type(original_filename),
-            width=width,
-            height=height,
-            exif_data=exif_data if exif_data else None,
-            taken_date=taken_date,
-        )
-        db.add(photo)
-        await db.flush()  # Get the ID
+        ml_results = None
+        processing_error = None
         
         try:
-            # Save full image
-            photo_path = settings.photos_dir / filename
-            save_image(image, photo_path)
-            
-            # Create and save thumbnail
-            thumbnail = create_thumbnail(image)
-            thumbnail_path = settings.thumbnails_dir / filename
-            save_image(thumbnail, thumbnail_path)
-            
-            # Run ML processing
-            await self._process_photo_ml(db, photo, image)
-            
-            photo.processed = True
+            # Run ML inference off the event loop; each model batches this
+            # image with other concurrent uploads, and the models overlap
+            # with each other and with encoding and writing the files
+            _, detections, faces, clip_embedding = await asyncio.gather(
+                asyncio.to_thread(self._save_files, image, filename, thumbnail_filename),
+                self._infer(ml_service.object_detector, image, filename, "YOLO detection", []),
+                self._infer(ml_service.face_detector, image, filename, "Face detection", []),
+                self._infer(ml_service.clip_image_encoder, image, filename, "CLIP embedding", None),
+            )
+            ml_results = {
+                "detections": detections,
+                "faces": faces,
+                "clip_embedding": clip_embedding,
+            }
             
         except Exception as e:
             logger.error(f"Error processing photo {filename}: {e}")
-            photo.processing_error = str(e)
-        
-        await db.commit()
+            processing_error = str(e)
         
-        # Save vector indices
-        vector_service.save_all()
+        async with self._write_lock:
+            # Create photo record
+            photo = Photo(
+                id=generate_uuid(),
+                filename=filename,
+                original_filename=original_filename,
+                thumbnail_filename=thumbnail_filename,
+                file_size=len(file_content),
+                mime_type=get_mime_type(original_filename),
+                width=width,
+                height=height,
+                exif_data=exif_data if exif_data else None,
+                taken_date=taken_date,
+                etag=content_hash,
+            )
+            db.add(photo)
+            
+            if ml_results is not None:
+                try:
+                    await self._save_ml_results(db, photo, ml_results)
+                    photo.processed = True
+                except Exception as e:
+                    logger.error(f"Error saving analysis for {filename}: {e}")
+                    photo.processing_error = str(e)
+            else:
+                photo.processing_error = processing_error
+            
+            await db.commit()
+            
+            # Load detections and faces for the response and cache its dict
+            photo = await self.get_photo(db, photo.id)
+            photo.cached_json = photo.to_dict()
+            await db.commit()
+            return photo
+    
+    def _prepare_image(self, file_content: bytes) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """Decode and downsize an upload and extract its EXIF (blocking)."""
+        image = load_image(file_content, max_size=settings.max_image_size)
+        image = resize_image(image)  # Resize if too large
+        return image, extract_exif(file_content)
+    
+    def _save_files(self, image: np.ndarray, filename: str, thumbnail_filename: str):
+        """Save the full image and its thumbnail (blocking)."""
+        save_image(image, settings.photos_dir / filename)
+        save_image(create_thumbnail(image), settings.thumbnails_dir / thumbnail_filename)
+    
+    async def _infer(
+        self,
+        encoder: BatchedEncoder,
+        image: np.ndarray,
+        filename: str,
+        name: str,
+        default: Any,
+    ) -> Any:
+        """
+        Run one model on an image through its batching encoder.
         
-        return photo
+        A failing model is logged and yields default so the others still run.
+        """
+        try:
+            output = await encoder.encode(image)
+            logger.debug(f"{name} done for {filename}")
+            return output
+        except Exception as e:
+            logger.error(f"{name} failed for {filename}: {e}")
+            return default
     
-    async def _process_photo_ml(
+    async def _save_ml_results(
         self,
         db: AsyncSession,
         photo: Photo,
-        image: np.ndarray
+        ml_results: Dict[str, Any],
     ):
-        """Run ML models on the photo."""
+        """
+        Persist ML results for a photo and update the vector indices.
         
-        # 1. YOLO Object Detection
-        try:
-            detections = ml_service.detect_objects(image)
-            for det in detections:
-                detection = Detection(
-                    photo_id=photo.id,
-                    class_name=det["class_name"],
-                    confidence=det["confidence"],
-                    bbox_x1=det["bbox"]["x1"],
-                    bbox_y1=det["bbox"]["y1"],
-                    bbox_x2=det["bbox"]["x2"],
-                    bbox_y2=det["bbox"]["y2"],
-                )
-                db.add(detection)
-            logger.debug(f"Detected {len(detections)} objects in {photo.filename}")
-        except Exception as e:
-            logger.error(f"YOLO detection failed for {photo.filename}: {e}")
+        Nothing is flushed here: the caller's commit writes the photo, its
+        detections, faces and new clusters as batched INSERTs (through the
+        ORM, so the flush updates the stats totals).
+        """
         
-        # 2. Face Detection & Recognition
-        try:
-            faces = ml_service.detect_faces(image)
-            for face_data in faces:
-                face = Face(
-                    photo_id=photo.id,
-                    confidence=face_data["confidence"],
-                    bbox_x1=face_data["bbox"]["x1"],
-                    bbox_y1=face_data["bbox"]["y1"],
-                    bbox_x2=face_data["bbox"]["x2"],
-                    bbox_y2=face_data["bbox"]["y2"],
-                    age=face_data.get("age"),
-                    gender=face_data.get("gender"),
-                )
-                
-                # Store embedding
-                if face_data.get("embedding") is not None:
-                    embedding = face_data["embedding"]
-                    face.embedding = embedding.tobytes()
-                    
-                    db.add(face)
-                    await db.flush()  # Get face ID
-                    
-                    # Add to vector index
-                    vector_service.add_face_embedding(face.id, embedding)
-                    
-                    # Assign to cluster
-                    await clustering_service.assign_face_to_cluster(db, face, embedding)
-                else:
-                    db.add(face)
+        # 1. Object detections
+        db.add_all([
+            Detection(
+                photo_id=photo.id,
+                class_name=det["class_name"],
+                confidence=det["confidence"],
+                bbox_x1=det["bbox"]["x1"],
+                bbox_y1=det["bbox"]["y1"],
+                bbox_x2=det["bbox"]["x2"],
+                bbox_y2=det["bbox"]["y2"],
+            )
+            for det in ml_results["detections"]
+        ])
+        
+        # 2. Faces (IDs assigned up front so no flush is needed to get them)
+        faces = []
+        for face_data in ml_results["faces"]:
+            face = Face(
+                id=generate_uuid(),
+                photo_id=photo.id,
+                confidence=face_data["confidence"],
+                bbox_x1=face_data["bbox"]["x1"],
+                bbox_y1=face_data["bbox"]["y1"],
+                bbox_x2=face_data["bbox"]["x2"],
+                bbox_y2=face_data["bbox"]["y2"],
+                age=face_data.get("age"),
+                gender=face_data.get("gender"),
+            )
+            if face_data.get("embedding") is not None:
+                face.embedding = to_blob(face_data["embedding"])
+            faces.append((face, face_data.get("embedding")))
+        db.add_all([face for face, _ in faces])
+        
+        clustered = [(face, embedding) for face, embedding in faces if embedding is not None]
+        if clustered:
+            clustered_faces = [face for face, _ in clustered]
+            embeddings = np.vstack([embedding for _, embedding in clustered])
             
-            logger.debug(f"Detected {len(faces)} faces in {photo.filename}")
-        except Exception as e:
-            logger.error(f"Face detection failed for {photo.filename}: {e}")
+            # Add to vector index (in a worker thread: the journal append is
+            # synced to disk); the stacked array is ours, so let it be
+            # normalized in place (cluster search below normalizes anyway)
+            await asyncio.to_thread(
+                vector_service.add_face_embeddings,
+                [face.id for face in clustered_faces], embeddings, copy=False,
+            )
+            
+            # Assign to clusters with one index search; only cluster_id is
+            # set, so it goes out with the faces' INSERT
+            await clustering_service.assign_faces_batch(db, clustered_faces, embeddings)
         
         # 3. CLIP Embedding
-        try:
-            clip_embedding = ml_service.get_clip_image_embedding(image)
-            photo.clip_embedding = clip_embedding.tobytes()
+        clip_embedding = ml_results["clip_embedding"]
+        if clip_embedding is not None:
+            photo.clip_embedding = to_blob(clip_embedding)
             
             # Add to vector index
-            vector_service.add_clip_embedding(photo.id, clip_embedding)
-            
-            logger.debug(f"Generated CLIP embedding for {photo.filename}")
-        except Exception as e:
-            logger.error(f"CLIP embedding failed for {photo.filename}: {e}")
+            await asyncio.to_thread(vector_service.add_clip_embedding, photo.id, clip_embedding)
     
     async def get_photo(self, db: AsyncSession, photo_id: str) -> Optional[Photo]:
         """Get a photo by ID with all relationships loaded."""
@@ -183,29 +259,169 @@ class PhotoService:
         )
         return result.scalar_one_or_none()
     
-    async def get_all_photos(self, db: AsyncSession) -> List[Photo]:
-        """Get all photos with relationships."""
+    async def get_photo_file(self, db: AsyncSession, photo_id: str):
+        """
+        Get just what's needed to serve a photo's files.
+        
+        Returns a row with filename, original_filename, thumbnail_filename,
+        mime_type and etag, or None. Skips loading the photo's detections
+        and faces.
+        """
+        result = await db.execute(
+            select(
+                Photo.filename,
+                Photo.original_filename,
+                Photo.thumbnail_filename,
+                Photo.mime_type,
+                Photo.etag,
+            )
+            .where(Photo.id == photo_id)
+        )
+        return result.one_or_none()
+    
+    async def list_photos(
+        self,
+        db: AsyncSession,
+        skip: int = 0,
+        limit: int = 100,
+    ) -> List[Photo]:
+        """
+        Get a page of photos, newest first, paginated in SQL.
+        
+        Relationships are not loaded; serialize with photo_dicts().
+        """
         result = await db.execute(
             select(Photo)
-            .options(selectinload(Photo.detections), selectinload(Photo.faces))
-            .order_by(Photo.upload_date.desc())
+            .order_by(Photo.upload_date.desc(), Photo.id)
+            .offset(skip)
+            .limit(limit)
         )
         return result.scalars().all()
     
+    async def photo_dicts(self, db: AsyncSession, photos: List[Photo]) -> List[Dict[str, Any]]:
+        """
+        Serialize photos for list endpoints from their cached_json.
+        
+        Photos without a cache get their relationships loaded and their
+        dict built, but nothing is written back: caches are refreshed on
+        the write paths (see refresh_photo_cache()), so reads never take
+        the database write lock.
+        """
+        dicts = {p.id: p.cached_json for p in photos if p.cached_json is not None}
+        missing_ids = [p.id for p in photos if p.cached_json is None]
+        if missing_ids:
+            result = await db.execute(
+                select(Photo)
+                .options(selectinload(Photo.detections), selectinload(Photo.faces))
+                .where(Photo.id.in_(missing_ids))
+            )
+            dicts.update({photo.id: photo.to_dict() for photo in result.scalars().all()})
+        
+        return [dicts[p.id] for p in photos]
+    
+    async def refresh_photo_cache(self, db: AsyncSession, photo_ids: Iterable[str]):
+        """
+        Rebuild the cached dicts of photos changed by a write.
+        
+        Called by write paths before they commit. Photos are reloaded with
+        populate_existing so faces changed by bulk UPDATEs are re-read, and
+        flushed a chunk at a time so the identity map can let them go.
+        """
+        photo_ids = list(photo_ids)
+        await db.flush()
+        for start in range(0, len(photo_ids), CACHE_REFRESH_CHUNK_SIZE):
+            result = await db.execute(
+                select(Photo)
+                .options(selectinload(Photo.detections), selectinload(Photo.faces))
+                .where(Photo.id.in_(photo_ids[start:start + CACHE_REFRESH_CHUNK_SIZE]))
+                .execution_options(populate_existing=True)
+            )
+            for photo in result.scalars().all():
+                photo.cached_json = photo.to_dict()
+            await db.flush()
+    
+    async def fill_photo_cache(self, db: AsyncSession):
+        """Build the caches of photos that don't have one (older databases)."""
+        result = await db.execute(select(Photo.id).where(Photo.cached_json.is_(None)))
+        photo_ids = result.scalars().all()
+        if photo_ids:
+            await self.refresh_photo_cache(db, photo_ids)
+            await db.commit()
+            logger.info(f"Cached dicts for {len(photo_ids)} photos")
+    
+    async def photo_dicts_by_id(self, db: AsyncSession, photo_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Map photo IDs to their dicts without loading Photo objects.
+        
+        Only the id and cached_json columns are selected, so fresh photos
+        cost no ORM bookkeeping; stale ones go through photo_dicts(). IDs
+        missing from the database are left out.
+        """
+        if not photo_ids:
+            return {}
+        
+        result = await db.execute(PHOTO_JSON_BY_IDS, {"ids": photo_ids})
+        dicts = dict(result.all())
+        
+        stale_ids = [photo_id for photo_id, cached in dicts.items() if cached is None]
+        if stale_ids:
+            result = await db.execute(PHOTOS_BY_IDS, {"ids": stale_ids})
+            stale = result.scalars().all()
+            for photo, photo_dict in zip(stale, await self.photo_dicts(db, stale)):
+                dicts[photo.id] = photo_dict
+        
+        return dicts
+    
+    async def iter_photo_dicts(
+        self,
+        db: AsyncSession,
+        batch_size: int = 500,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield every photo's dict, newest first, a batch at a time.
+        
+        Batches are fetched by keyset (after the last upload_date/id seen)
+        so each is an indexed range scan with no cursor held open between
+        them, and the identity map is cleared after each so memory stays
+        at one batch whatever the gallery size.
+        """
+        last = None
+        while True:
+            query = (
+                select(Photo)
+                .order_by(Photo.upload_date.desc(), Photo.id)
+                .limit(batch_size)
+            )
+            if last is not None:
+                last_date, last_id = last
+                query = query.where(or_(
+                    Photo.upload_date < last_date,
+                    and_(Photo.upload_date == last_date, Photo.id > last_id),
+                ))
+            
+            photos = (await db.execute(query)).scalars().all()
+            if not photos:
+                return
+            
+            for photo_dict in await self.photo_dicts(db, photos):
+                yield photo_dict
+            
+            last = (photos[-1].upload_date, photos[-1].id)
+            db.expunge_all()
+    
     async def delete_photo(self, db: AsyncSession, photo_id: str) -> bool:
         """Delete a photo and all associated data."""
         photo = await self.get_photo(db, photo_id)
         if not photo:
             return False
         
-        # Remove from vector indices
-        vector_service.remove_photo(photo_id)
-        for face in photo.faces:
-            vector_service.remove_face(face.id)
+        # Remove from vector indices, one synced journal append each
+        await asyncio.to_thread(vector_service.remove_photo, photo_id)
+        await asyncio.to_thread(vector_service.remove_faces, [face.id for face in photo.faces])
         
         # Delete files
         photo_path = settings.photos_dir / photo.filename
-        thumbnail_path = settings.thumbnails_dir / photo.filename
+        thumbnail_path = settings.thumbnails_dir / (photo.thumbnail_filename or photo.filename)
         
         if photo_path.exists():
             os.remove(photo_path)
@@ -216,25 +432,30 @@ class PhotoService:
         await db.delete(photo)
         await db.commit()
         
-        vector_service.save_all()
-        
         return True
     
-    async def get_photo_image(self, photo_id: str) -> Optional[Tuple[bytes, str]]:
-        """Get photo image bytes and mime type."""
-        # We need to look up the filename from DB
-        async with settings.database_url:
-            pass  # This would need a proper implementation
-        
-        # For now, search in photos directory
-        for photo_path in settings.photos_dir.iterdir():
-            if photo_path.stem.endswith(photo_id[:8]):  # Rough match
-                async with aiofiles.open(photo_path, 'rb') as f:
-                    content = await f.read()
-                mime_type = get_mime_type(photo_path.name)
-                return content, mime_type
-        
-        return None
+    async def get_photo_image(
+        self, db: AsyncSession, photo_id: str
+    ) -> Optional[Tuple[bytes, str]]:
+        """
+        Get photo image bytes and mime type.
+        
+        The filename comes from a primary-key lookup. The API serves files
+        with FileResponse (sendfile) via get_photo_file() instead; this is
+        for callers that need the bytes themselves.
+        """
+        row = await self.get_photo_file(db, photo_id)
+        if row is None:
+            return None
+        
+        photo_path = settings.photos_dir / row.filename
+        try:
+            async with aiofiles.open(photo_path, 'rb') as f:
+                content = await f.read()
+        except FileNotFoundError:
+            return None
+        
+        return content, row.mime_type or get_mime_type(row.filename)
     
     async def update_favorite(
         self, 
@@ -246,58 +467,63 @@ class PhotoService:
         photo = await self.get_photo(db, photo_id)
         if photo:
             photo.is_favorite = is_favorite
+            photo.cached_json = photo.to_dict()
             await db.commit()
         return photo
     
     async def get_stats(self, db: AsyncSession) -> GalleryStats:
-        """Get gallery statistics."""
-        # Total photos
-        result = await db.execute(select(func.count(Photo.id)))
-        total_photos = result.scalar() or 0
-        
-        # Total faces
-        result = await db.execute(select(func.count(Face.id)))
-        total_faces = result.scalar() or 0
-        
-        # Total people (clusters)
-        result = await db.execute(select(func.count(Cluster.id)))
-        total_people = result.scalar() or 0
-        
-        # Total detections
-        result = await db.execute(select(func.count(Detection.id)))
-        total_objects = result.scalar() or 0
+        """
+        Get gallery statistics from the running totals in one query.
         
-        # Categories count
+        The totals row is outer-joined to the non-empty category counters,
+        so it comes back once per category (once with NULLs if there are
+        none). Plain columns, not ORM objects: the counters are updated by
+        SQL during flushes, so an identity-map copy could be stale.
+        """
         result = await db.execute(
-            select(Detection.class_name, func.count(Detection.id))
-            .group_by(Detection.class_name)
+            select(
+                Stats.photo_count,
+                Stats.face_count,
+                Stats.cluster_count,
+                Stats.detection_count,
+                Stats.storage_used,
+                CategoryStats.class_name,
+                CategoryStats.count.label("category_count"),
+            )
+            .outerjoin(CategoryStats, CategoryStats.count > 0)
+            .where(Stats.id == STATS_ROW_ID)
         )
-        categories = {row[0]: row[1] for row in result.all()}
-        
-        # Storage used
-        result = await db.execute(select(func.sum(Photo.file_size)))
-        storage_used = result.scalar() or 0
+        rows = result.all()
+        stats = rows[0]
+        categories = {
+            row.class_name: row.category_count for row in rows if row.class_name is not None
+        }
         
         return GalleryStats(
-            total_photos=total_photos,
-            total_faces=total_faces,
-            total_people=total_people,
-            total_objects=total_objects,
+            total_photos=stats.photo_count,
+            total_faces=stats.face_count,
+            total_people=stats.cluster_count,
+            total_objects=stats.detection_count,
             categories=categories,
-            storage_used=storage_used,
+            storage_used=stats.storage_used,
         )
     
     async def get_categories(self, db: AsyncSession) -> List[CategoryResponse]:
-        """Get all object categories with counts."""
+        """
+        Get all object categories with counts.
+        
+        Reads only the (class_name, photo_id) index: rows come grouped in
+        index order, and count(*) needs no other column.
+        """
         result = await db.execute(
             select(
                 Detection.class_name,
-                func.count(Detection.id).label('count'),
+                func.count().label('count'),
                 # Use group_concat for SQLite compatibility (instead of array_agg)
                 func.group_concat(Detection.photo_id.distinct()).label('photo_ids')
             )
             .group_by(Detection.class_name)
-            .order_by(func.count(Detection.id).desc())
+            .order_by(func.count().desc())
         )
         
         categories = []
@@ -315,13 +541,22 @@ class PhotoService:
         return categories
     
     async def get_clusters(self, db: AsyncSession) -> List[Cluster]:
-        """Get all face clusters."""
+        """Get all face clusters with their faces eagerly loaded."""
         result = await db.execute(
             select(Cluster)
             .options(selectinload(Cluster.faces))
             .order_by(Cluster.created_at.desc())
         )
         return result.scalars().all()
+    
+    async def get_cluster(self, db: AsyncSession, cluster_id: str) -> Optional[Cluster]:
+        """Get a cluster by ID with its faces eagerly loaded."""
+        result = await db.execute(
+            select(Cluster)
+            .options(selectinload(Cluster.faces))
+            .where(Cluster.id == cluster_id)
+        )
+        return result.scalar_one_or_none()
 
 
 # Global instance
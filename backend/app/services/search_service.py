@@ -3,30 +3,98 @@ Smart Gallery Backend - Search Service
 Handles semantic search using CLIP and face search.
 """
 import numpy as np
-from typing import List, Optional
+import asyncio
+import hashlib
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, bindparam
 import logging
 
+from app.core.config import settings
 from app.models.database import Photo, Face
-from app.models.schemas import SearchResult, PhotoResponse
-from app.services.ml_service import ml_service
+from app.services.ml_service import ml_service, BatchedEncoder
+from app.services.photo_service import photo_service
 from app.services.vector_service import vector_service
-from app.utils.image import load_image
+from app.utils.image import load_image, resize_image
+from app.utils.embedding import from_blob
 
 logger = logging.getLogger(__name__)
 
+# Built once so per-search work is just binding parameters
+PHOTO_IDS_BY_ETAG = select(Photo.id).where(Photo.etag == bindparam("etag"))
+FACE_PHOTO_IDS = select(Face.id, Face.photo_id).where(
+    Face.id.in_(bindparam("ids", expanding=True))
+)
+
+
+def _normalize_query(query: str) -> str:
+    """Normalize a text query for caching (CLIP's tokenizer lowercases anyway)."""
+    return " ".join(query.split()).lower()
+
+
+@lru_cache(maxsize=settings.text_embedding_cache_size)
+def _encode_text_cached(query: str) -> np.ndarray:
+    """CLIP text embedding for a normalized query, memoized across requests."""
+    embedding = ml_service.get_clip_text_embedding(query)
+    # Cached arrays are shared between callers, so make them immutable
+    embedding.setflags(write=False)
+    return embedding
+
 
 class SearchService:
     """Service for searching photos using various methods."""
     
+    def __init__(self):
+        # Concurrent CLIP searches share one index call (a single matrix
+        # product for flat indices instead of one per query)
+        self.clip_searcher = BatchedEncoder(
+            vector_service.search_clip_requests,
+            max_batch=settings.search_batch_size,
+            max_wait_ms=settings.search_batch_wait_ms,
+        )
+    
+    async def close(self):
+        """Stop the search batching worker (at shutdown)."""
+        await self.clip_searcher.close()
+    
+    def text_cache_info(self) -> Dict[str, Any]:
+        """Hit/miss statistics for the CLIP text embedding cache."""
+        return _encode_text_cached.cache_info()._asdict()
+    
+    async def _build_results(
+        self,
+        db: AsyncSession,
+        similar: List[Tuple[str, float]],
+        match_type: str,
+    ) -> List[Dict[str, Any]]:
+        """
+        Look up the photo dicts for (photo_id, similarity) hits in one query.
+        
+        Results are plain dicts shaped like SearchResult, with the photo
+        from its cached dict (no Photo objects are loaded unless a cache
+        is stale); response_model validation happens once in FastAPI.
+        They keep the order of the hits; IDs missing from the database
+        are skipped.
+        """
+        if not similar:
+            return []
+        
+        photo_dicts = await photo_service.photo_dicts_by_id(
+            db, [photo_id for photo_id, _ in similar]
+        )
+        return [
+            {"photo": photo_dicts[photo_id], "similarity": similarity, "match_type": match_type}
+            for photo_id, similarity in similar
+            if photo_id in photo_dicts
+        ]
+    
     async def search_by_text(
         self,
         db: AsyncSession,
         query: str,
         limit: int = 20,
-    ) -> List[SearchResult]:
+    ) -> List[Dict[str, Any]]:
         """
         Search photos using natural language query via CLIP.
         
@@ -36,39 +104,24 @@ class SearchService:
             limit: Maximum number of results
             
         Returns:
-            List of SearchResult with photo and similarity score
+            List of result dicts with photo, similarity and match_type
         """
-        # Get text embedding from CLIP
-        text_embedding = ml_service.get_clip_text_embedding(query)
+        # Get text embedding from CLIP (cached for repeated queries); a
+        # miss runs the text encoder, so keep it off the event loop
+        text_embedding = await asyncio.to_thread(_encode_text_cached, _normalize_query(query))
         
-        # Search in vector index
-        similar = vector_service.search_by_clip(text_embedding, k=limit)
+        # Search in vector index, batched with concurrent searches (in a
+        # worker thread, under the index's read lock)
+        similar = await self.clip_searcher.encode((text_embedding, limit))
         
-        results = []
-        for photo_id, similarity in similar:
-            # Get full photo data
-            result = await db.execute(
-                select(Photo)
-                .options(selectinload(Photo.detections), selectinload(Photo.faces))
-                .where(Photo.id == photo_id)
-            )
-            photo = result.scalar_one_or_none()
-            
-            if photo:
-                results.append(SearchResult(
-                    photo=PhotoResponse(**photo.to_dict()),
-                    similarity=similarity,
-                    match_type='semantic'
-                ))
-        
-        return results
+        return await self._build_results(db, similar, match_type='semantic')
     
     async def search_by_image(
         self,
         db: AsyncSession,
         image_bytes: bytes,
         limit: int = 20,
-    ) -> List[SearchResult]:
+    ) -> List[Dict[str, Any]]:
         """
         Search for similar photos using an uploaded image.
         
@@ -78,39 +131,38 @@ class SearchService:
             limit: Maximum number of results
             
         Returns:
-            List of SearchResult with photo and similarity score
+            List of result dicts with photo, similarity and match_type
         """
-        # Load and get embedding
-        image = load_image(image_bytes)
-        query_embedding = ml_service.get_clip_image_embedding(image)
+        # Byte-identical photos are found by their hash (the photo's ETag)
+        # and listed first
+        etag = (await asyncio.to_thread(hashlib.sha256, image_bytes)).hexdigest()
+        result = await db.execute(PHOTO_IDS_BY_ETAG, {"etag": etag})
+        exact = [(photo_id, 1.0) for photo_id in result.scalars().all()][:limit]
         
-        # Search in vector index
-        similar = vector_service.search_by_clip(query_embedding, k=limit)
+        # Decode and embed off the event loop
+        query_embedding = await asyncio.to_thread(self._embed_image, image_bytes)
         
-        results = []
-        for photo_id, similarity in similar:
-            result = await db.execute(
-                select(Photo)
-                .options(selectinload(Photo.detections), selectinload(Photo.faces))
-                .where(Photo.id == photo_id)
-            )
-            photo = result.scalar_one_or_none()
-            
-            if photo:
-                results.append(SearchResult(
-                    photo=PhotoResponse(**photo.to_dict()),
-                    similarity=similarity,
-                    match_type='semantic'
-                ))
+        # Search in vector index; the exact matches come back here too, so
+        # ask for enough to fill the limit once they're dropped
+        similar = await self.clip_searcher.encode((query_embedding, limit + len(exact)))
+        exact_ids = {photo_id for photo_id, _ in exact}
+        similar = [hit for hit in similar if hit[0] not in exact_ids]
         
-        return results
+        results = await self._build_results(db, exact, match_type='exact')
+        results += await self._build_results(db, similar, match_type='semantic')
+        return results[:limit]
+    
+    def _embed_image(self, image_bytes: bytes) -> np.ndarray:
+        """Decode an image and compute its CLIP embedding (blocking)."""
+        image = load_image(image_bytes, max_size=settings.max_image_size)
+        return ml_service.get_clip_image_embedding(resize_image(image))
     
     async def find_similar_photos(
         self,
         db: AsyncSession,
         photo_id: str,
         limit: int = 20,
-    ) -> List[SearchResult]:
+    ) -> List[Dict[str, Any]]:
         """
         Find photos similar to a given photo using CLIP embeddings.
         
@@ -124,45 +176,27 @@ class SearchService:
         """
         # Get the photo's embedding
         result = await db.execute(
-            select(Photo).where(Photo.id == photo_id)
+            select(Photo.clip_embedding).where(Photo.id == photo_id)
         )
-        photo = result.scalar_one_or_none()
+        clip_embedding = result.scalar_one_or_none()
         
-        if not photo or not photo.clip_embedding:
+        if not clip_embedding:
             return []
         
-        query_embedding = np.frombuffer(photo.clip_embedding, dtype=np.float32)
+        query_embedding = from_blob(clip_embedding)
         
         # Search (exclude self by getting limit+1 and filtering)
-        similar = vector_service.search_by_clip(query_embedding, k=limit + 1)
+        similar = await self.clip_searcher.encode((query_embedding, limit + 1))
+        similar = [(pid, similarity) for pid, similarity in similar if pid != photo_id]
         
-        results = []
-        for pid, similarity in similar:
-            if pid == photo_id:  # Skip self
-                continue
-            
-            result = await db.execute(
-                select(Photo)
-                .options(selectinload(Photo.detections), selectinload(Photo.faces))
-                .where(Photo.id == pid)
-            )
-            p = result.scalar_one_or_none()
-            
-            if p:
-                results.append(SearchResult(
-                    photo=PhotoResponse(**p.to_dict()),
-                    similarity=similarity,
-                    match_type='semantic'
-                ))
-        
-        return results[:limit]
+        return await self._build_results(db, similar[:limit], match_type='semantic')
     
     async def search_by_face(
         self,
         db: AsyncSession,
         face_id: str,
         limit: int = 20,
-    ) -> List[SearchResult]:
+    ) -> List[Dict[str, Any]]:
         """
         Find photos containing similar faces.
         
@@ -176,54 +210,35 @@ class SearchService:
         """
         # Get face embedding
         result = await db.execute(
-            select(Face).where(Face.id == face_id)
+            select(Face.embedding).where(Face.id == face_id)
         )
-        face = result.scalar_one_or_none()
+        embedding = result.scalar_one_or_none()
         
-        if not face or not face.embedding:
+        if not embedding:
             return []
         
-        query_embedding = np.frombuffer(face.embedding, dtype=np.float32)
+        query_embedding = from_blob(embedding)
         
         # Search for similar faces
-        similar_faces = vector_service.search_by_face(query_embedding, k=limit * 2)
+        hits = await asyncio.to_thread(vector_service.search_by_face, query_embedding, limit * 2)
+        similar_faces = [(fid, similarity) for fid, similarity in hits if fid != face_id]
+        if not similar_faces:
+            return []
         
-        # Get unique photos
-        seen_photos = set()
-        results = []
+        # Map all hit faces to their photos in one query
+        result = await db.execute(FACE_PHOTO_IDS, {"ids": [fid for fid, _ in similar_faces]})
+        photo_ids = dict(result.all())
         
+        # Unique photos, each with its best (first) face similarity
+        similar = {}
         for fid, similarity in similar_faces:
-            if fid == face_id:
-                continue
-            
-            # Get face's photo
-            result = await db.execute(
-                select(Face).where(Face.id == fid)
-            )
-            similar_face = result.scalar_one_or_none()
-            
-            if similar_face and similar_face.photo_id not in seen_photos:
-                seen_photos.add(similar_face.photo_id)
-                
-                # Get full photo
-                result = await db.execute(
-                    select(Photo)
-                    .options(selectinload(Photo.detections), selectinload(Photo.faces))
-                    .where(Photo.id == similar_face.photo_id)
-                )
-                photo = result.scalar_one_or_none()
-                
-                if photo:
-                    results.append(SearchResult(
-                        photo=PhotoResponse(**photo.to_dict()),
-                        similarity=similarity,
-                        match_type='face'
-                    ))
-                
-                if len(results) >= limit:
+            photo_id = photo_ids.get(fid)
+            if photo_id is not None and photo_id not in similar:
+                similar[photo_id] = similarity
+                if len(similar) >= limit:
                     break
         
-        return results
+        return await self._build_results(db, list(similar.items()), match_type='face')
     
     async def search_by_person(
         self,
@@ -240,14 +255,14 @@ class SearchService:
             limit: Maximum number of results
             
         Returns:
-            List of photos
+            List of photos (relationships not loaded; see photo_dicts())
         """
         result = await db.execute(
             select(Photo)
-            .options(selectinload(Photo.detections), selectinload(Photo.faces))
             .join(Face)
             .where(Face.cluster_id == cluster_id)
             .distinct()
+            .order_by(Photo.upload_date.desc(), Photo.id)
             .limit(limit)
         )
         return result.scalars().all()
@@ -269,13 +284,12 @@ class SearchService:
             limit: Maximum number of results
             
         Returns:
-            List of photos
+            List of photos (relationships not loaded; see photo_dicts())
         """
         from app.models.database import Detection
         
         result = await db.execute(
             select(Photo)
-            .options(selectinload(Photo.detections), selectinload(Photo.faces))
             .join(Detection)
             .where(
                 Detection.class_name == class_name,
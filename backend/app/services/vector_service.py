@@ -8,108 +8,549 @@ from pathlib import Path
 from typing import List, Tuple, Optional, Dict
 import pickle
 import logging
-from threading import Lock
+import io
+import os
+import struct
+from contextlib import contextmanager
+from threading import Condition, Lock, local
 
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
+_gpu_resources = None  # faiss.StandardGpuResources, created on first use
+
+
+def _gpu_resources_once():
+    """Shared GPU scratch memory for all GPU indices."""
+    global _gpu_resources
+    if _gpu_resources is None:
+        _gpu_resources = faiss.StandardGpuResources()
+    return _gpu_resources
+
+
+# Share of tombstoned (removed) vectors that triggers a compacting rebuild
+COMPACT_FRACTION = 0.1
+
+# Journal records: op byte and ID count, then the IDs as 36-byte strings
+# and, for adds, their (already normalized) float32 vectors
+JOURNAL_HEADER = struct.Struct("<cI")
+JOURNAL_ADD = b"A"
+JOURNAL_REMOVE = b"R"
+JOURNAL_CLEAR = b"C"
+
+
+class RWLock:
+    """
+    Reader/writer lock: any number of readers, or one writer.
+    
+    FAISS searches are safe to run concurrently on an index that isn't
+    being modified. Waiting writers block new readers, so a steady stream
+    of searches can't starve an add.
+    """
+    
+    def __init__(self):
+        self._cond = Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+    
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+    
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
 
 class VectorIndex:
     """FAISS-based vector index for similarity search."""
     
-    def __init__(self, dimension: int, index_path: Path, id_map_path: Path):
+    def __init__(
+        self,
+        dimension: int,
+        index_path: Path,
+        id_map_path: Path,
+        index_type: str = "flat",
+        precision: str = "fp32",
+        assume_normalized: bool = False,
+    ):
         self.dimension = dimension
         self.index_path = index_path
         self.id_map_path = id_map_path
+        self.index_type = index_type  # 'flat' (exact) or 'hnsw' (approximate)
+        self.precision = precision  # 'fp32', 'fp16' or 'int8' vector storage
+        self.assume_normalized = assume_normalized  # inputs are already unit-norm
         self.index: Optional[faiss.Index] = None
-        self.id_map: List[str] = []  # Maps FAISS index to photo/face IDs
-        self.lock = Lock()
+        self.id_map: List[Optional[str]] = []  # Maps FAISS index to photo/face IDs (None: removed)
+        self.id_to_idx: Dict[str, int] = {}  # Reverse of id_map, live entries only
+        self.deleted = 0  # Tombstoned entries still in the index
+        self.lock = RWLock()  # searches share it; changes are exclusive
+        self.gpu_index: Optional[faiss.Index] = None  # search-only GPU copy
+        self.gpu_lock = Lock()  # GPU indices aren't safe for concurrent calls
+        self._vector_buf = local()  # per-thread (1, dimension) scratch array
+        self.journal_path = index_path.with_suffix(".wal")  # changes since the snapshot
+        self.save_lock = Lock()  # one snapshot at a time
+        
+        self.journal = None  # opened on the first change
         
         self._load_or_create()
     
     def _load_or_create(self):
         """Load existing index or create new one."""
-        if self.index_path.exists() and self.id_map_path.exists():
+        legacy_id_map_path = self.id_map_path.with_suffix(".pkl")
+        if self.index_path.exists() and (
+            self.id_map_path.exists() or legacy_id_map_path.exists()
+        ):
             try:
                 self.index = faiss.read_index(str(self.index_path))
-                with open(self.id_map_path, 'rb') as f:
-                    self.id_map = pickle.load(f)
+                if self.id_map_path.exists():
+                    self._set_ids(self._load_ids(self.id_map_path))
+                else:
+                    # Written by an older version; saved as .npy from now on
+                    with open(legacy_id_map_path, 'rb') as f:
+                        self._set_ids(pickle.load(f))
                 logger.info(f"Loaded index with {self.index.ntotal} vectors")
+                
+                if not self._has_configured_type(self.index):
+                    self._compact()
+                    logger.info(f"Rebuilt index as '{self.index_type}'")
+                elif self.index_type == "hnsw":
+                    # efSearch is a query-time knob; always apply current setting
+                    self.index.hnsw.efSearch = settings.hnsw_ef_search
+                self._replay_journal()
+                self._to_gpu()
                 return
             except Exception as e:
                 logger.warning(f"Failed to load index: {e}, creating new")
+                self._move_journal_aside()
+        elif self.index_path.exists():
+            logger.warning(f"Index {self.index_path} has no ID map, creating new")
+            self._move_journal_aside()
         
-        # Create new index - using IndexFlatIP for cosine similarity (with normalized vectors)
-        self.index = faiss.IndexFlatIP(self.dimension)
-        self.id_map = []
-        logger.info(f"Created new index with dimension {self.dimension}")
+        self.index = self._new_index()
+        self._set_ids([])
+        self._replay_journal()
+        self._to_gpu()
+        logger.info(f"Created new '{self.index_type}' index with dimension {self.dimension}")
+    
+    def _to_gpu(self):
+        """
+        Mirror the index on the GPU for searching, when enabled.
+        
+        The CPU index stays the source of truth (persistence, reconstruct,
+        rebuilds); adds go to both. FAISS's GPU indices have no HNSW or
+        plain scalar quantizer, so only flat fp32 indices are mirrored.
+        """
+        self.gpu_index = None
+        if not settings.faiss_gpu:
+            return
+        if self.index_type != "flat" or self._quantizer_type() is not None:
+            logger.warning(
+                f"FAISS_GPU needs a flat fp32 index, not '{self.index_type}'/"
+                f"'{self.precision}'; searching on the CPU"
+            )
+            return
+        if not hasattr(faiss, "StandardGpuResources") or faiss.get_num_gpus() == 0:
+            logger.warning("FAISS_GPU is set but no GPU build of FAISS/GPU is available")
+            return
+        self.gpu_index = faiss.index_cpu_to_gpu(_gpu_resources_once(), 0, self.index)
+    
+    @staticmethod
+    def _load_ids(path: Path) -> List[Optional[str]]:
+        """
+        Read an ID map saved by save(); empty entries are tombstones.
+        
+        The array is only the on-disk format (plain data, never unpickled);
+        in memory the IDs live as str objects shared with id_to_idx, so
+        this saves no memory over the old pickled list.
+        """
+        ids = np.load(path, allow_pickle=False).astype(str).tolist()
+        return [id or None for id in ids]
+    
+    def _set_ids(self, ids: List[str]):
+        """Replace the ID map and its reverse lookup together."""
+        self.id_map = ids
+        self.id_to_idx = {id: idx for idx, id in enumerate(ids) if id is not None}
+        self.deleted = len(ids) - len(self.id_to_idx)
+    
+    def _new_index(self) -> faiss.Index:
+        """
+        Create an empty index of the configured type and precision.
+        
+        All variants use inner product, which equals cosine similarity for
+        the L2-normalized vectors stored here. HNSW trades exactness for
+        logarithmic search time on large collections; fp16/int8 storage
+        halves/quarters memory and scan bandwidth.
+        """
+        qtype = self._quantizer_type()
+        
+        if self.index_type == "hnsw":
+            if qtype is None:
+                index = faiss.IndexHNSWFlat(
+                    self.dimension, settings.hnsw_m, faiss.METRIC_INNER_PRODUCT
+                )
+            else:
+                index = faiss.IndexHNSWSQ(
+                    self.dimension, qtype, settings.hnsw_m, faiss.METRIC_INNER_PRODUCT
+                )
+            index.hnsw.efConstruction = settings.hnsw_ef_construction
+            index.hnsw.efSearch = settings.hnsw_ef_search
+        elif qtype is None:
+            index = faiss.IndexFlatIP(self.dimension)
+        else:
+            index = faiss.IndexScalarQuantizer(
+                self.dimension, qtype, faiss.METRIC_INNER_PRODUCT
+            )
+        
+        if not index.is_trained:
+            # Training on two extremes fixes the int8 range without needing
+            # real data. Components of a unit vector average 1/sqrt(d) in
+            # magnitude, so [-1, 1] would waste most of the 256 levels;
+            # 8/sqrt(d) keeps outliers in range and rare larger ones clip.
+            limit = min(1.0, 8.0 / np.sqrt(self.dimension))
+            bounds = np.full((2, self.dimension), limit, dtype=np.float32)
+            bounds[0] = -limit
+            index.train(bounds)
+        
+        return index
+    
+    def _quantizer_type(self) -> Optional[int]:
+        """Scalar quantizer type for the configured precision (None = fp32)."""
+        if self.precision == "fp16":
+            return faiss.ScalarQuantizer.QT_fp16
+        if self.precision == "int8":
+            return faiss.ScalarQuantizer.QT_8bit
+        return None
+    
+    def _has_configured_type(self, index: faiss.Index) -> bool:
+        """Check whether a loaded index matches the configured type and precision."""
+        index = faiss.downcast_index(index)
+        
+        if self.index_type == "hnsw":
+            if not isinstance(index, faiss.IndexHNSW):
+                return False
+            storage = faiss.downcast_index(index.storage)
+        else:
+            storage = index
+        
+        qtype = self._quantizer_type()
+        if qtype is None:
+            return (
+                isinstance(storage, faiss.IndexFlat)
+                and storage.metric_type == faiss.METRIC_INNER_PRODUCT
+            )
+        return isinstance(storage, faiss.IndexScalarQuantizer) and storage.sq.qtype == qtype
+    
+    def _all_vectors(self) -> np.ndarray:
+        """Reconstruct all stored vectors in index order."""
+        if self.index.ntotal == 0:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return self.index.reconstruct_n(0, self.index.ntotal)
+    
+    def _rebuild(self, vectors: np.ndarray):
+        """Replace the index with a new one of the configured type."""
+        self.index = self._new_index()
+        if len(vectors):
+            self.index.add(vectors)
+        self._to_gpu()
     
     def save(self):
-        """Persist index to disk."""
-        with self.lock:
+        """
+        Snapshot the index to disk and drop the journal it covers.
+        
+        Tombstones past COMPACT_FRACTION are compacted away first, here
+        rather than in remove(), so the rebuild runs with the periodic
+        snapshot off the event loop. The index is then serialized in
+        memory under the read lock, so changes (which journal under the
+        write lock) only wait for that copy, not for the disk writes.
+        Journal records added meanwhile are kept.
+        """
+        with self.save_lock:
             try:
-                faiss.write_index(self.index, str(self.index_path))
-                with open(self.id_map_path, 'wb') as f:
-                    pickle.dump(self.id_map, f)
-                logger.debug(f"Saved index with {self.index.ntotal} vectors")
+                with self.lock.write():
+                    if self.deleted > COMPACT_FRACTION * len(self.id_map):
+                        self._compact()
+                
+                with self.lock.read():
+                    data = faiss.serialize_index(self.index)
+                    # One fixed-width byte array (UUIDs are 36 ASCII chars),
+                    # so loading never unpickles files from the data dir
+                    ids = np.array(
+                        [(id or "").encode() for id in self.id_map], dtype="S36"
+                    )
+                    # Everything journaled so far, including records
+                    # replayed at startup, is in this snapshot
+                    covered = self._journal_size()
+                
+                self._write_atomic(self.index_path, data.tobytes())
+                id_map_buf = io.BytesIO()
+                np.save(id_map_buf, ids, allow_pickle=False)
+                self._write_atomic(self.id_map_path, id_map_buf.getvalue())
+                
+                with self.lock.write():
+                    self._truncate_journal(covered)
+                logger.debug(f"Saved index with {len(ids)} vectors")
             except Exception as e:
                 logger.error(f"Failed to save index: {e}")
     
+    @staticmethod
+    def _sync_dir(path: Path):
+        """fsync a file's directory so a create or rename in it is durable."""
+        fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    
+    @classmethod
+    def _write_atomic(cls, path: Path, data: bytes):
+        """
+        Write a file via a temporary one so readers never see it half-written.
+        
+        The data and the rename are synced before returning, so the journal
+        a snapshot covers is only dropped once the snapshot is on disk.
+        """
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        cls._sync_dir(path)
+    
+    def _journal_size(self) -> int:
+        """Bytes in the journal file (lock held)."""
+        if self.journal is not None:
+            return self.journal.tell()
+        return self.journal_path.stat().st_size if self.journal_path.exists() else 0
+    
+    def _truncate_journal(self, covered: int):
+        """Drop the first `covered` journal bytes (write lock held)."""
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if not self.journal_path.exists():
+            return
+        
+        with open(self.journal_path, 'rb') as f:
+            f.seek(covered)
+            rest = f.read()
+        if rest:
+            self._write_atomic(self.journal_path, rest)
+        else:
+            self.journal_path.unlink()
+            self._sync_dir(self.journal_path)
+    
+    def _journal(self, op: bytes, ids: List[str] = (), vectors: Optional[np.ndarray] = None):
+        """
+        Append a change to the journal and sync it (write lock held).
+        
+        One small fsync'd append per change replaces rewriting the whole
+        index after each upload; snapshots happen periodically instead.
+        """
+        try:
+            if self.journal is None:
+                created = not self.journal_path.exists()
+                self.journal = open(self.journal_path, "ab")
+                if created:
+                    self._sync_dir(self.journal_path)
+            parts = [
+                JOURNAL_HEADER.pack(op, len(ids)),
+                np.array([id.encode() for id in ids], dtype="S36").tobytes(),
+            ]
+            if vectors is not None:
+                parts.append(vectors.tobytes())
+            self.journal.write(b"".join(parts))
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+        except Exception as e:
+            logger.error(f"Failed to journal index change: {e}")
+    
+    def _move_journal_aside(self):
+        """
+        Move the journal out of the way when its snapshot can't be loaded.
+        
+        The journal only holds the changes since that snapshot, so
+        replaying it onto an empty index would give a partial one that the
+        next save would persist as complete. It is kept for inspection.
+        """
+        if not self.journal_path.exists():
+            return
+        orphaned = self.journal_path.with_suffix(".wal.orphaned")
+        self.journal_path.replace(orphaned)
+        self._sync_dir(orphaned)
+        logger.warning(f"Skipped replaying {self.journal_path}; kept it as {orphaned}")
+    
+    def _replay_journal(self):
+        """
+        Apply the changes journaled since the last snapshot.
+        
+        Replay is idempotent (IDs already present aren't re-added), so a
+        crash between a snapshot and its journal truncation is harmless.
+        A torn record at the end is discarded.
+        """
+        if not self.journal_path.exists():
+            return
+        
+        data = self.journal_path.read_bytes()
+        row_bytes = self.dimension * 4
+        pos = records = 0
+        while pos + JOURNAL_HEADER.size <= len(data):
+            op, n = JOURNAL_HEADER.unpack_from(data, pos)
+            ids_at = pos + JOURNAL_HEADER.size
+            end = ids_at + n * 36 + (n * row_bytes if op == JOURNAL_ADD else 0)
+            if op not in (JOURNAL_ADD, JOURNAL_REMOVE, JOURNAL_CLEAR) or end > len(data):
+                break
+            
+            ids = np.frombuffer(data, dtype="S36", count=n, offset=ids_at).astype(str).tolist()
+            if op == JOURNAL_ADD:
+                vectors = np.frombuffer(
+                    data, dtype=np.float32, count=n * self.dimension, offset=ids_at + n * 36
+                ).reshape(n, self.dimension)
+                new = [i for i, id in enumerate(ids) if id not in self.id_to_idx]
+                if new:
+                    self._append([ids[i] for i in new], np.ascontiguousarray(vectors[new]))
+            elif op == JOURNAL_REMOVE:
+                for id in ids:
+                    self._tombstone(id)
+            else:
+                self._rebuild(np.zeros((0, self.dimension), dtype=np.float32))
+                self._set_ids([])
+            pos = end
+            records += 1
+        
+        if pos < len(data):
+            logger.warning(f"Discarding {len(data) - pos} bytes of incomplete journal")
+            self._write_atomic(self.journal_path, data[:pos])
+        if records:
+            if self.deleted > COMPACT_FRACTION * len(self.id_map):
+                self._compact()
+            logger.info(f"Replayed {records} journaled index changes")
+    
+    def _normalized_vector(self, vector: np.ndarray) -> np.ndarray:
+        """
+        L2-normalize a single vector into this thread's scratch buffer.
+        
+        The buffer is reused by the next call on the same thread; FAISS
+        copies what it's given, so it never outlives an add or search.
+        """
+        buf = getattr(self._vector_buf, "arr", None)
+        if buf is None:
+            buf = self._vector_buf.arr = np.empty((1, self.dimension), dtype=np.float32)
+        np.copyto(buf, vector.reshape(1, -1))
+        if not self.assume_normalized:
+            faiss.normalize_L2(buf)
+        return buf
+    
     def add(self, id: str, embedding: np.ndarray):
         """Add a single embedding to the index."""
-        with self.lock:
-            # Normalize for cosine similarity
-            embedding = embedding.astype(np.float32).reshape(1, -1)
-            faiss.normalize_L2(embedding)
-            
-            self.index.add(embedding)
-            self.id_map.append(id)
-    
-    def add_batch(self, ids: List[str], embeddings: np.ndarray):
-        """Add multiple embeddings to the index."""
-        with self.lock:
-            embeddings = embeddings.astype(np.float32)
-            if len(embeddings.shape) == 1:
-                embeddings = embeddings.reshape(1, -1)
-            
+        # Normalize for cosine similarity (before taking the lock)
+        embedding = self._normalized_vector(embedding)
+        
+        with self.lock.write():
+            self._append([id], embedding)
+            self._journal(JOURNAL_ADD, [id], embedding)
+    
+    def add_batch(self, ids: List[str], embeddings: np.ndarray, copy: bool = True):
+        """
+        Add multiple embeddings to the index.
+        
+        Vectors are L2-normalized in place, so by default they're copied
+        first. Callers passing an array they own and won't read again can
+        set copy=False; it's then only converted if it isn't already
+        C-contiguous float32. Indices with assume_normalized never
+        modify the input, so they never copy it needlessly.
+        """
+        # Copy and normalize before taking the lock; only the index and ID
+        # map updates need it
+        if copy and not self.assume_normalized:
+            embeddings = np.array(embeddings, dtype=np.float32, order="C")
+        else:
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if len(embeddings.shape) == 1:
+            embeddings = embeddings.reshape(1, -1)
+        if not self.assume_normalized:
             faiss.normalize_L2(embeddings)
-            
-            self.index.add(embeddings)
-            self.id_map.extend(ids)
+        
+        with self.lock.write():
+            self._append(ids, embeddings)
+            self._journal(JOURNAL_ADD, ids, embeddings)
+    
+    def _append(self, ids: List[str], embeddings: np.ndarray):
+        """Add normalized float32 vectors and their IDs (lock held)."""
+        self.index.add(embeddings)
+        if self.gpu_index is not None:
+            self.gpu_index.add(embeddings)
+        self.id_to_idx.update(zip(ids, range(len(self.id_map), len(self.id_map) + len(ids))))
+        self.id_map.extend(ids)
+    
+    def reset(self, ids: List[str], embeddings: np.ndarray, copy: bool = True):
+        """Replace the whole index contents with a batch of embeddings."""
+        with self.lock.write():
+            self._rebuild(np.zeros((0, self.dimension), dtype=np.float32))
+            self._set_ids([])
+            self._journal(JOURNAL_CLEAR)
+        if len(ids):
+            self.add_batch(ids, embeddings, copy=copy)
     
     def remove(self, id: str) -> bool:
+        """Remove an embedding by ID."""
+        return self.remove_batch([id]) == 1
+    
+    def remove_batch(self, ids: List[str]) -> int:
         """
-        Remove an embedding by ID.
-        Note: FAISS IndexFlatIP doesn't support removal, so we rebuild.
+        Remove embeddings by ID; returns how many were present.
+        
+        HNSW graphs can't delete nodes, so entries are tombstoned: their
+        id_map slots become None and searches skip them. The rebuild that
+        drops them happens in save(), so a delete costs one journal append
+        (one fsync for the whole batch) instead of a rebuild.
         """
-        with self.lock:
-            if id not in self.id_map:
-                return False
-            
-            idx = self.id_map.index(id)
-            
-            # Get all vectors except the one to remove
-            if self.index.ntotal <= 1:
-                self.index = faiss.IndexFlatIP(self.dimension)
-                self.id_map = []
-                return True
-            
-            # Reconstruct all vectors
-            all_vectors = np.zeros((self.index.ntotal, self.dimension), dtype=np.float32)
-            for i in range(self.index.ntotal):
-                all_vectors[i] = self.index.reconstruct(i)
-            
-            # Remove the vector
-            new_vectors = np.delete(all_vectors, idx, axis=0)
-            new_ids = self.id_map[:idx] + self.id_map[idx+1:]
-            
-            # Rebuild index
-            self.index = faiss.IndexFlatIP(self.dimension)
-            self.index.add(new_vectors)
-            self.id_map = new_ids
-            
-            return True
+        with self.lock.write():
+            removed = [id for id in ids if self._tombstone(id)]
+            if removed:
+                self._journal(JOURNAL_REMOVE, removed)
+            return len(removed)
+    
+    def _tombstone(self, id: str) -> bool:
+        """Mark an ID's slot as removed (lock held); False if it's absent."""
+        idx = self.id_to_idx.pop(id, None)
+        if idx is None:
+            return False
+        
+        self.id_map[idx] = None
+        self.deleted += 1
+        return True
+    
+    def _compact(self):
+        """Rebuild the index without tombstoned entries (lock held)."""
+        live = [idx for idx, id in enumerate(self.id_map) if id is not None]
+        vectors = self._all_vectors()[live]
+        self._rebuild(vectors)
+        self._set_ids([self.id_map[idx] for idx in live])
     
     def search(self, query: np.ndarray, k: int = 10) -> List[Tuple[str, float]]:
         """
@@ -122,36 +563,82 @@ class VectorIndex:
         Returns:
             List of (id, similarity) tuples
         """
-        with self.lock:
-            if self.index.ntotal == 0:
-                return []
-            
-            query = query.astype(np.float32).reshape(1, -1)
-            faiss.normalize_L2(query)
-            
-            k = min(k, self.index.ntotal)
-            similarities, indices = self.index.search(query, k)
+        return self._search_normalized(self._normalized_vector(query), k)[0]
+    
+    def search_batch(self, queries: np.ndarray, k: int = 10) -> List[List[Tuple[str, float]]]:
+        """
+        Search for several query vectors in one FAISS call.
+        
+        Args:
+            queries: Query embeddings, shape (n, dimension)
+            k: Number of results per query
             
-            results = []
-            for sim, idx in zip(similarities[0], indices[0]):
-                if idx >= 0 and idx < len(self.id_map):
-                    results.append((self.id_map[idx], float(sim)))
+        Returns:
+            List of (id, similarity) tuples for each query
+        """
+        if self.assume_normalized:
+            queries = np.ascontiguousarray(queries, dtype=np.float32)
+        else:
+            queries = np.array(queries, dtype=np.float32)
+            faiss.normalize_L2(queries)
+        return self._search_normalized(queries, k)
+    
+    def _search_normalized(self, queries: np.ndarray, k: int) -> List[List[Tuple[str, float]]]:
+        """
+        Run a search for already normalized float32 queries.
+        
+        Tombstoned hits are dropped, so each query over-fetches a little
+        (at most k extra) rather than by the whole tombstone count, which
+        would make HNSW explore far more candidates on every search. Only
+        queries left with fewer than k live hits are searched again, with
+        a larger k, until the whole index has been covered.
+        """
+        with self.lock.read():
+            ntotal = self.index.ntotal
+            if ntotal == 0:
+                return [[] for _ in range(len(queries))]
             
-            return results
+            wanted = min(k, len(self.id_to_idx))
+            k_search = min(k + min(self.deleted, k), ntotal)
+            results: List[List[Tuple[str, float]]] = [[] for _ in range(len(queries))]
+            pending = np.arange(len(queries))
+            while True:
+                similarities, indices = self._raw_search(queries[pending], k_search)
+                short = []
+                for row, row_similarities, row_indices in zip(pending, similarities, indices):
+                    results[row] = [
+                        (self.id_map[idx], float(sim))
+                        for sim, idx in zip(row_similarities, row_indices)
+                        if 0 <= idx < len(self.id_map) and self.id_map[idx] is not None
+                    ][:k]
+                    if len(results[row]) < wanted:
+                        short.append(row)
+                
+                if not short or k_search >= ntotal:
+                    return results
+                pending = np.array(short)
+                k_search = min(k_search * 4, ntotal)
+    
+    def _raw_search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """One FAISS search, on the GPU copy when there is one (lock held)."""
+        if self.gpu_index is not None:
+            with self.gpu_lock:
+                return self.gpu_index.search(queries, k)
+        return self.index.search(queries, k)
     
     def get_embedding(self, id: str) -> Optional[np.ndarray]:
         """Get embedding by ID."""
-        with self.lock:
-            if id not in self.id_map:
+        with self.lock.read():
+            idx = self.id_to_idx.get(id)
+            if idx is None:
                 return None
             
-            idx = self.id_map.index(id)
             return self.index.reconstruct(idx)
     
     @property
     def count(self) -> int:
-        """Number of vectors in index."""
-        return self.index.ntotal if self.index else 0
+        """Number of (live) vectors in index."""
+        return len(self.id_to_idx)
 
 
 class VectorSearchService:
@@ -174,14 +661,23 @@ class VectorSearchService:
         self.clip_index = VectorIndex(
             dimension=768,
             index_path=embeddings_dir / "clip_index.faiss",
-            id_map_path=embeddings_dir / "clip_id_map.pkl"
+            id_map_path=embeddings_dir / "clip_id_map.npy",
+            index_type=settings.clip_index_type,
+            precision=settings.embedding_precision,
+            # CLIP embeddings are normalized by ml_service, both when stored
+            # and as queries
+            assume_normalized=True,
         )
         
         # Face embeddings (512-dim for InsightFace)
         self.face_index = VectorIndex(
             dimension=512,
             index_path=embeddings_dir / "face_index.faiss",
-            id_map_path=embeddings_dir / "face_id_map.pkl"
+            id_map_path=embeddings_dir / "face_id_map.npy",
+            index_type=settings.face_index_type,
+            precision=settings.face_embedding_precision,
+            # Faces stored before ingest-time normalization hold raw
+            # InsightFace embeddings, and reclustering re-adds those
         )
         
         self._initialized = True
@@ -195,6 +691,12 @@ class VectorSearchService:
         """Add face embedding."""
         self.face_index.add(face_id, embedding)
     
+    def add_face_embeddings(
+        self, face_ids: List[str], embeddings: np.ndarray, copy: bool = True
+    ):
+        """Add a batch of face embeddings (see VectorIndex.add_batch for copy)."""
+        self.face_index.add_batch(face_ids, embeddings, copy=copy)
+    
     def remove_photo(self, photo_id: str):
         """Remove all embeddings for a photo."""
         self.clip_index.remove(photo_id)
@@ -203,20 +705,39 @@ class VectorSearchService:
         """Remove face embedding."""
         self.face_index.remove(face_id)
     
+    def remove_faces(self, face_ids: List[str]):
+        """Remove a batch of face embeddings."""
+        self.face_index.remove_batch(face_ids)
+    
     def search_by_clip(self, query_embedding: np.ndarray, k: int = 20) -> List[Tuple[str, float]]:
         """Search photos by CLIP embedding similarity."""
         return self.clip_index.search(query_embedding, k)
     
+    def search_clip_requests(
+        self, requests: List[Tuple[np.ndarray, int]]
+    ) -> List[List[Tuple[str, float]]]:
+        """Run (query, k) CLIP searches as one batch, each cut to its own k."""
+        queries = np.vstack([query.reshape(1, -1) for query, _ in requests])
+        hits = self.clip_index.search_batch(queries, max(k for _, k in requests))
+        return [row[:k] for row, (_, k) in zip(hits, requests)]
+    
     def search_by_face(self, query_embedding: np.ndarray, k: int = 20) -> List[Tuple[str, float]]:
         """Search faces by embedding similarity."""
         return self.face_index.search(query_embedding, k)
     
+    def search_by_faces(self, query_embeddings: np.ndarray, k: int = 20) -> List[List[Tuple[str, float]]]:
+        """Search faces for a batch of embeddings at once."""
+        return self.face_index.search_batch(query_embeddings, k)
+    
     def find_similar_faces(self, face_id: str, k: int = 20) -> List[Tuple[str, float]]:
         """Find faces similar to a given face."""
         embedding = self.face_index.get_embedding(face_id)
         if embedding is None:
             return []
-        return self.face_index.search(embedding, k + 1)[1:]  # Exclude self
+        # Drop self by ID: it needn't rank first (ties, approximate or
+        # quantized indices), and if it's missing nothing should be cut
+        hits = self.face_index.search(embedding, k + 1)
+        return [(fid, similarity) for fid, similarity in hits if fid != face_id][:k]
     
     def save_all(self):
         """Persist all indices to disk."""
@@ -0,0 +1,33 @@
+"""
+Smart Gallery Backend - Embedding Serialization
+"""
+import numpy as np
+from typing import List
+
+
+def to_blob(embedding: np.ndarray) -> memoryview:
+    """
+    Expose an embedding's memory as a byte buffer for a BLOB column.
+    
+    Unlike tobytes() this doesn't copy a contiguous float32 array; the
+    database driver reads the buffer directly when the row is written.
+    Views and other dtypes are converted to contiguous float32 (what
+    from_blob() reads back) in a single copy. The view keeps the array
+    alive, so don't modify it before the flush.
+    """
+    return memoryview(np.ascontiguousarray(embedding, dtype=np.float32)).cast("B")
+
+
+def from_blob(blob: bytes, dtype=np.float32) -> np.ndarray:
+    """Read-only array view over a stored embedding (no copy)."""
+    return np.frombuffer(blob, dtype=dtype)
+
+
+def from_blobs(blobs: List[bytes], dtype=np.float32) -> np.ndarray:
+    """
+    Stack equal-length stored embeddings into one (N, dim) matrix.
+    
+    The blobs are joined into a single buffer, so the matrix is built with
+    one copy instead of one array per row plus a vstack.
+    """
+    return np.frombuffer(b"".join(blobs), dtype=dtype).reshape(len(blobs), -1)
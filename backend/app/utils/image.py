@@ -3,43 +3,151 @@ Smart Gallery Backend - Image Processing Utilities
 """
 import cv2
 import numpy as np
+import piexif
 from PIL import Image, ExifTags
 from pathlib import Path
 from typing import Tuple, Optional, Dict, Any
 import io
-import hashlib
 from datetime import datetime
+import time
 import logging
 
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_420  # libjpeg-turbo with DCT scaling
+    _turbojpeg = TurboJPEG()
+except (ImportError, RuntimeError, OSError):  # package or shared library missing
+    _turbojpeg = None
 
-def generate_filename(original_filename: str, content: bytes) -> str:
-    """Generate a unique filename based on content hash."""
-    ext = Path(original_filename).suffix.lower()
-    if ext not in ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic']:
+JPEG_MAGIC = b"\xff\xd8\xff"
+
+EXIF_ORIENTATION_TAG = 274
+
+MIME_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.heic': 'image/heic',
+    '.heif': 'image/heif',
+}
+DEFAULT_MIME_TYPE = 'image/jpeg'
+
+# Extensions kept for stored files; anything else is saved as .jpg
+STORED_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic'})
+
+# OpenCV's DCT-scaled JPEG decode flags, by reduction factor
+CV2_REDUCED_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+
+
+def jpeg_backend() -> str:
+    """Describe the JPEG codec in use, for the startup log."""
+    if _turbojpeg is not None:
+        return "TurboJPEG (libjpeg-turbo)"
+    for line in cv2.getBuildInformation().splitlines():
+        if line.strip().startswith("JPEG:"):
+            return f"OpenCV ({line.split(':', 1)[1].strip()})"
+    return "OpenCV"
+
+
+def generate_filename(original_filename: str, content_hash: str) -> str:
+    """Generate a unique filename from the content's hex digest."""
+    ext = _extension(original_filename)
+    if ext not in STORED_EXTENSIONS:
         ext = '.jpg'
     
-    content_hash = hashlib.md5(content).hexdigest()[:16]
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    
-    return f"{timestamp}_{content_hash}{ext}"
+    # Nanosecond upload time in hex: sorts by time and doesn't collide
+    # within a second the way a formatted timestamp could
+    return f"{time.time_ns():x}_{content_hash[:16]}{ext}"
+
+
+def _jpeg_scaling_factor(width: int, height: int, max_size: int) -> Optional[Tuple[int, int]]:
+    """Smallest libjpeg-turbo scale that keeps the image at least max_size."""
+    for num, denom in sorted(
+        _turbojpeg.scaling_factors, key=lambda factor: factor[0] / factor[1]
+    ):
+        if num <= denom and max(width, height) * num // denom >= max_size:
+            return num, denom
+    return None
 
 
-def load_image(file_content: bytes) -> np.ndarray:
+def _cv2_decode_flags(file_content: bytes, max_size: int) -> int:
+    """imdecode flags scaling a large JPEG down to no less than max_size."""
+    try:
+        # Reads the SOF header only, no pixels
+        width, height = Image.open(io.BytesIO(file_content)).size
+    except Exception:
+        return cv2.IMREAD_COLOR
+    for factor, flags in CV2_REDUCED_FLAGS.items():
+        if max(width, height) // factor >= max_size:
+            return flags
+    return cv2.IMREAD_COLOR
+
+
+def _exif_orientation(file_content: bytes) -> int:
+    """EXIF orientation of an image (1 = upright); reads headers only."""
+    try:
+        return Image.open(io.BytesIO(file_content)).getexif().get(EXIF_ORIENTATION_TAG, 1)
+    except Exception:
+        return 1
+
+
+def _apply_orientation(image: np.ndarray, orientation: int) -> np.ndarray:
+    """Rotate/flip a decoded image upright, as cv2.imdecode does itself."""
+    if orientation in (5, 6, 7, 8):
+        image = cv2.transpose(image)
+    # cv2.flip codes: 1 = horizontal, 0 = vertical, -1 = both
+    flip_code = {2: 1, 3: -1, 4: 0, 6: 1, 7: -1, 8: 0}.get(orientation)
+    if flip_code is not None:
+        image = cv2.flip(image, flip_code)
+    return image
+
+
+def load_image(file_content: bytes, max_size: int = None) -> np.ndarray:
     """
     Load image from bytes into OpenCV format (BGR).
     
+    JPEGs are decoded with libjpeg-turbo when it's installed. Given
+    max_size, large JPEGs are scaled down during the IDCT (by TurboJPEG,
+    or by OpenCV's reduced decode otherwise), which skips most of the
+    decode work; the result is still at least max_size, so
+    resize_image() finishes the job at full quality.
+    
     Args:
         file_content: Raw image bytes
+        max_size: Size the caller will downsize to, if any
         
     Returns:
         BGR numpy array
     """
+    if _turbojpeg is not None and file_content[:3] == JPEG_MAGIC:
+        try:
+            scaling_factor = None
+            if max_size is not None:
+                width, height, _, _ = _turbojpeg.decode_header(file_content)
+                scaling_factor = _jpeg_scaling_factor(width, height, max_size)
+            image = _turbojpeg.decode(
+                file_content, pixel_format=TJPF_BGR, scaling_factor=scaling_factor
+            )
+            # Unlike cv2.imdecode, TurboJPEG ignores the EXIF orientation
+            return _apply_orientation(image, _exif_orientation(file_content))
+        except (OSError, ValueError) as e:
+            logger.debug(f"TurboJPEG decode failed, falling back to OpenCV: {e}")
+    
+    flags = cv2.IMREAD_COLOR
+    if max_size is not None and file_content[:3] == JPEG_MAGIC:
+        flags = _cv2_decode_flags(file_content, max_size)
+    
     nparr = np.frombuffer(file_content, np.uint8)
-    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    image = cv2.imdecode(nparr, flags)
     
     if image is None:
         raise ValueError("Failed to decode image")
@@ -91,14 +199,24 @@ def create_thumbnail(image: np.ndarray, size: Tuple[int, int] = None) -> np.ndar
         size = settings.thumbnail_size
     
     h, w = image.shape[:2]
+    side = min(h, w)
     
-    # Crop to square from center
-    if w > h:
-        start = (w - h) // 2
-        image = image[:, start:start + h]
-    elif h > w:
-        start = (h - w) // 2
-        image = image[start:start + w, :]
+    # For large downscales, first shrink by a whole factor down to about
+    # twice the target: OpenCV's INTER_AREA has a fast path for integer
+    # scales. Trimming the crop to a multiple of the factor keeps it exact.
+    factor = side // (2 * max(size))
+    if factor >= 2:
+        side -= side % factor
+    
+    # Crop to square from center (a view, no copy)
+    top = (h - side) // 2
+    left = (w - side) // 2
+    image = image[top:top + side, left:left + side]
+    
+    if factor >= 2:
+        image = cv2.resize(
+            image, (side // factor, side // factor), interpolation=cv2.INTER_AREA
+        )
     
     # Resize to thumbnail size
     return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
@@ -118,7 +236,15 @@ def save_image(image: np.ndarray, path: Path, quality: int = None) -> None:
     
     ext = path.suffix.lower()
     
-    if ext in ['.jpg', '.jpeg']:
+    if ext in ['.jpg', '.jpeg'] and _turbojpeg is not None:
+        # libjpeg-turbo takes BGR input directly, no conversion pass;
+        # 4:2:0 chroma subsampling like cv2.imwrite's default
+        data = _turbojpeg.encode(
+            image, quality=quality, pixel_format=TJPF_BGR, jpeg_subsample=TJSAMP_420
+        )
+        with open(path, 'wb') as f:
+            f.write(data)
+    elif ext in ['.jpg', '.jpeg']:
         cv2.imwrite(str(path), image, [cv2.IMWRITE_JPEG_QUALITY, quality])
     elif ext == '.png':
         cv2.imwrite(str(path), image, [cv2.IMWRITE_PNG_COMPRESSION, 6])
@@ -163,6 +289,23 @@ def image_to_bytes(image: np.ndarray, format: str = 'jpeg', quality: int = None)
     return buffer.tobytes()
 
 
+def bgr_to_pil(image: np.ndarray) -> Image.Image:
+    """
+    Convert a BGR numpy array to an RGB PIL Image.
+    
+    PIL's raw "BGR" decoder swaps the channels while unpacking into its
+    own storage, so there's no intermediate RGB copy of the array.
+    
+    Args:
+        image: BGR numpy array (uint8, HxWx3)
+        
+    Returns:
+        RGB PIL Image
+    """
+    h, w = image.shape[:2]
+    return Image.frombuffer("RGB", (w, h), np.ascontiguousarray(image), "raw", "BGR", 0, 1)
+
+
 def _convert_exif_value(value: Any) -> Any:
     """
     Recursively convert EXIF values to JSON-serializable types.
@@ -218,16 +361,73 @@ def _convert_exif_value(value: Any) -> Any:
         return None
 
 
+# IFD pointer tags; piexif follows them itself
+_EXIF_POINTER_TAGS = {
+    piexif.ImageIFD.ExifTag, piexif.ImageIFD.GPSTag, piexif.ExifIFD.InteroperabilityTag,
+}
+
+
+def _convert_piexif_value(value: Any, tag_type: int) -> Any:
+    """Convert a raw piexif value to the same form the PIL path produces."""
+    if tag_type == piexif.TYPES.Ascii:
+        value = value.decode(errors="replace").rstrip("\x00") if isinstance(value, bytes) else value
+    elif tag_type in (piexif.TYPES.Rational, piexif.TYPES.SRational):
+        # (num, den) or a tuple of them
+        if value and isinstance(value[0], tuple):
+            value = [num / den if den else None for num, den in value]
+        else:
+            num, den = value
+            value = num / den if den else None
+    return _convert_exif_value(value)
+
+
+def _extract_exif_piexif(file_content: bytes) -> Dict[str, Any]:
+    """Read EXIF from a JPEG's APP1 segment only (no PIL image object)."""
+    exif = piexif.load(file_content)
+    
+    result = {}
+    for ifd in ("0th", "Exif"):
+        for tag_id, value in exif.get(ifd, {}).items():
+            if tag_id in _EXIF_POINTER_TAGS:
+                continue
+            info = piexif.TAGS[ifd].get(tag_id)
+            name = info["name"] if info else str(tag_id)
+            converted_value = _convert_piexif_value(value, info["type"] if info else None)
+            if converted_value is not None:
+                result[name] = converted_value
+    
+    # GPS tags nested by number, as PIL's _getexif() reports them
+    gps = {}
+    for tag_id, value in exif.get("GPS", {}).items():
+        info = piexif.TAGS["GPS"].get(tag_id)
+        converted_value = _convert_piexif_value(value, info["type"] if info else None)
+        if converted_value is not None:
+            gps[str(tag_id)] = converted_value
+    if gps:
+        result["GPSInfo"] = gps
+    
+    return result
+
+
 def extract_exif(file_content: bytes) -> Dict[str, Any]:
     """
     Extract EXIF data from image.
     
+    JPEGs are parsed with piexif, which reads just the Exif segment;
+    other formats go through PIL.
+    
     Args:
         file_content: Raw image bytes
         
     Returns:
         Dictionary of EXIF data (JSON-serializable)
     """
+    if file_content[:3] == JPEG_MAGIC:
+        try:
+            return _extract_exif_piexif(file_content)
+        except Exception as e:
+            logger.debug(f"piexif failed, falling back to PIL: {e}")
+    
     try:
         pil_image = Image.open(io.BytesIO(file_content))
         exif_data = pil_image._getexif()
@@ -282,16 +482,12 @@ def get_image_dimensions(image: np.ndarray) -> Tuple[int, int]:
     return w, h
 
 
+def _extension(filename: str) -> str:
+    """Lowercased extension including the dot, without building a Path."""
+    i = filename.rfind('.')
+    return filename[i:].lower() if i >= 0 else ''
+
+
 def get_mime_type(filename: str) -> str:
     """Get MIME type from filename extension."""
-    ext = Path(filename).suffix.lower()
-    mime_types = {
-        '.jpg': 'image/jpeg',
-        '.jpeg': 'image/jpeg',
-        '.png': 'image/png',
-        '.gif': 'image/gif',
-        '.webp': 'image/webp',
-        '.heic': 'image/heic',
-        '.heif': 'image/heif',
-    }
-    return mime_types.get(ext, 'image/jpeg')
\ No newline at end of file
+    return MIME_TYPES.get(_extension(filename), DEFAULT_MIME_TYPE)
\ No newline at end of file
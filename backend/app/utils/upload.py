@@ -0,0 +1,36 @@
+"""
+Smart Gallery Backend - Upload Utilities
+"""
+from fastapi import UploadFile
+
+async def read_upload(file: UploadFile, max_size: int) -> bytes:
+    """
+    Read an uploaded file, refusing it if it exceeds max_size.
+    
+    Starlette spools multipart bodies to a temporary file, so oversized
+    uploads are rejected without ever being copied into memory. The read
+    is a single call capped at max_size + 1 bytes, which lands the content
+    straight in one bytes object (no chunk list or bytearray to copy out
+    of), while still never reading more than one byte past the limit.
+    
+    Args:
+        file: Uploaded file
+        max_size: Maximum allowed size in bytes
+        
+    Returns:
+        File content
+        
+    Raises:
+        ValueError: If the file is larger than max_size
+    """
+    too_large = f"File too large. Maximum size is {max_size // (1024 * 1024)}MB."
+    
+    # Starlette records the spooled size; reject without reading when known
+    if file.size is not None and file.size > max_size:
+        raise ValueError(too_large)
+    
+    content = await file.read(max_size + 1)
+    if len(content) > max_size:
+        raise ValueError(too_large)
+    
+    return content
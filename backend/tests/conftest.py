@@ -0,0 +1,47 @@
+"""
+Shared fixtures: a throwaway SQLite database and face index per test, so
+nothing touches the real data directory.
+"""
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+
+from app.core.database import _seed_stats
+from app.models.database import Base
+from app.services.vector_service import VectorIndex, vector_service
+
+FACE_DIM = 8
+
+
+@pytest.fixture
+async def db(tmp_path):
+    """Session on a fresh database, configured like AsyncSessionLocal."""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/gallery.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_seed_stats)
+    
+    session_factory = async_sessionmaker(
+        engine, class_=AsyncSession, expire_on_commit=False, autoflush=False
+    )
+    async with session_factory() as session:
+        yield session
+    await engine.dispose()
+
+
+def make_index(tmp_path, name="index", **kwargs) -> VectorIndex:
+    """Small VectorIndex stored under tmp_path."""
+    return VectorIndex(
+        dimension=kwargs.pop("dimension", FACE_DIM),
+        index_path=tmp_path / f"{name}.faiss",
+        id_map_path=tmp_path / f"{name}_id_map.npy",
+        **kwargs,
+    )
+
+
+@pytest.fixture
+def face_index(tmp_path, monkeypatch):
+    """Stand-in for vector_service.face_index; snapshots are skipped."""
+    index = make_index(tmp_path, "face_index")
+    monkeypatch.setattr(vector_service, "face_index", index)
+    monkeypatch.setattr(vector_service, "save_all", lambda: None)
+    return index
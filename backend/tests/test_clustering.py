@@ -0,0 +1,121 @@
+"""Tests for face clustering: threshold_components and recluster_all."""
+import numpy as np
+import pytest
+from scipy.sparse.csgraph import connected_components
+from sqlalchemy import select
+
+from app.models.database import Photo, Face, Cluster
+from app.services.clustering_service import clustering_service, threshold_components
+from app.services.photo_service import photo_service
+from app.utils.embedding import to_blob
+from tests.conftest import FACE_DIM
+
+
+def same_partition(a: np.ndarray, b: np.ndarray) -> bool:
+    """Whether two labelings group the items identically."""
+    return np.array_equal(a[:, None] == a[None, :], b[:, None] == b[None, :])
+
+
+def reference_components(embeddings: np.ndarray, threshold: float) -> np.ndarray:
+    """Components of the full (dense) similarity graph."""
+    normed = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    _, labels = connected_components(normed @ normed.T >= threshold, directed=False)
+    return labels
+
+
+@pytest.mark.parametrize("block_size", [1, 7, 1024])
+def test_threshold_components_matches_dense_graph(block_size):
+    rng = np.random.default_rng(0)
+    # Noisy copies of a few centers, so there are real groups to find
+    centers = rng.normal(size=(6, FACE_DIM))
+    embeddings = np.repeat(centers, 10, axis=0) + 0.3 * rng.normal(size=(60, FACE_DIM))
+    
+    labels = threshold_components(embeddings, 0.8, block_size=block_size)
+    
+    assert same_partition(labels, reference_components(embeddings, 0.8))
+
+
+def test_threshold_components_follows_chains_across_blocks():
+    # Each vector is only similar to its neighbours, and a block of 2 never
+    # sees both ends of the chain at once
+    angles = np.linspace(0, np.pi / 2, 10)
+    embeddings = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+    
+    labels = threshold_components(embeddings, np.cos(np.pi / 15), block_size=2)
+    
+    assert (labels == 0).all()
+
+
+def test_threshold_components_numbers_labels_from_zero():
+    embeddings = np.array([[1, 0], [0, 1], [1, 0.01], [-1, 0]], dtype=np.float32)
+    
+    labels = threshold_components(embeddings, 0.9, block_size=2)
+    
+    assert same_partition(labels, np.array([0, 1, 0, 2]))
+    assert sorted(set(labels.tolist())) == [0, 1, 2]
+
+
+def test_threshold_components_empty():
+    labels = threshold_components(np.zeros((0, FACE_DIM), dtype=np.float32), 0.5)
+    
+    assert len(labels) == 0
+
+
+def add_photo(db, name: str) -> Photo:
+    photo = Photo(
+        filename=f"{name}.jpg",
+        original_filename=f"{name}.jpg",
+        file_size=1,
+        mime_type="image/jpeg",
+    )
+    db.add(photo)
+    return photo
+
+
+def add_face(db, photo: Photo, embedding=None, cluster_id=None) -> Face:
+    face = Face(
+        photo=photo,
+        confidence=0.9,
+        bbox_x1=0, bbox_y1=0, bbox_x2=1, bbox_y2=1,
+        embedding=None if embedding is None else to_blob(np.asarray(embedding, dtype=np.float32)),
+        cluster_id=cluster_id,
+    )
+    db.add(face)
+    return face
+
+
+async def test_recluster_all_refreshes_photo_caches(db, face_index):
+    person_a = np.eye(FACE_DIM)[0]
+    person_b = np.eye(FACE_DIM)[1]
+    
+    old_cluster = Cluster()
+    db.add(old_cluster)
+    await db.flush()
+    
+    group, alone, no_embedding = (add_photo(db, name) for name in ("group", "alone", "blank"))
+    add_face(db, group, person_a, cluster_id=old_cluster.id)
+    add_face(db, group, person_b, cluster_id=old_cluster.id)
+    add_face(db, alone, person_a + 0.01, cluster_id=old_cluster.id)
+    # Never clustered again, so it has to lose its old cluster
+    add_face(db, no_embedding, cluster_id=old_cluster.id)
+    await db.flush()
+    await photo_service.refresh_photo_cache(db, [group.id, alone.id, no_embedding.id])
+    await db.commit()
+    
+    await clustering_service.recluster_all(db)
+    
+    result = await db.execute(select(Face.photo_id, Face.id, Face.cluster_id))
+    clusters_by_face = {face_id: cluster_id for _, face_id, cluster_id in result.all()}
+    result = await db.execute(select(Photo))
+    for photo in result.scalars().all():
+        cached = {face["id"]: face["cluster_id"] for face in photo.cached_json["faces"]}
+        assert cached == {face_id: clusters_by_face[face_id] for face_id in cached}
+    
+    cached = {p.id: p.cached_json for p in (group, alone, no_embedding)}
+    assert cached[no_embedding.id]["faces"][0]["cluster_id"] is None
+    assert old_cluster.id not in clusters_by_face.values()
+    group_clusters = {face["cluster_id"] for face in cached[group.id]["faces"]}
+    assert len(group_clusters) == 2
+    assert cached[alone.id]["faces"][0]["cluster_id"] in group_clusters
+    
+    assert face_index.count == 3
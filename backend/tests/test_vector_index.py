@@ -0,0 +1,141 @@
+"""Tests for VectorIndex changes, snapshots and journal replay."""
+import numpy as np
+import pytest
+
+from tests.conftest import FACE_DIM, make_index
+
+
+def vectors(n: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(n, FACE_DIM)).astype(np.float32)
+
+
+def ids(n: int):
+    return [f"{i:036d}" for i in range(n)]
+
+
+def nearest(index, vector) -> str:
+    return index.search(vector, k=1)[0][0]
+
+
+@pytest.mark.parametrize("index_type,precision", [
+    ("flat", "fp32"), ("flat", "int8"), ("hnsw", "fp32"), ("hnsw", "fp16"),
+])
+def test_add_and_search(tmp_path, index_type, precision):
+    index = make_index(tmp_path, index_type=index_type, precision=precision)
+    data = vectors(20)
+    index.add_batch(ids(20), data)
+    index.add("extra", -data[0])
+    
+    assert index.count == 21
+    for id, vector in zip(ids(20), data):
+        assert nearest(index, vector) == id
+    assert nearest(index, -data[0]) == "extra"
+    assert index.search(data[3], k=1)[0][1] == pytest.approx(1.0, abs=0.02)
+
+
+def test_remove_hides_vectors(tmp_path):
+    index = make_index(tmp_path)
+    data = vectors(10)
+    index.add_batch(ids(10), data)
+    
+    assert index.remove(ids(10)[0])
+    assert not index.remove("missing")
+    assert index.remove_batch(ids(10)[1:3]) == 2
+    
+    assert index.count == 7
+    assert index.get_embedding(ids(10)[0]) is None
+    results = index.search(data[0], k=10)
+    assert len(results) == 7
+    assert not {id for id, _ in results} & set(ids(10)[:3])
+
+
+def test_save_and_reload(tmp_path):
+    index = make_index(tmp_path)
+    data = vectors(10)
+    index.add_batch(ids(10), data)
+    index.remove(ids(10)[4])
+    index.save()
+    
+    assert not index.journal_path.exists()
+    reloaded = make_index(tmp_path)
+    assert reloaded.count == 9
+    assert reloaded.get_embedding(ids(10)[4]) is None
+    for id, vector in zip(ids(10), data):
+        if id != ids(10)[4]:
+            assert nearest(reloaded, vector) == id
+
+
+def test_save_compacts_tombstones(tmp_path):
+    index = make_index(tmp_path)
+    index.add_batch(ids(10), vectors(10))
+    index.remove_batch(ids(10)[:5])
+    index.save()
+    
+    reloaded = make_index(tmp_path)
+    assert len(reloaded.id_map) == reloaded.count == 5
+
+
+def test_journal_replays_changes_since_snapshot(tmp_path):
+    index = make_index(tmp_path)
+    data = vectors(10)
+    index.add_batch(ids(10)[:5], data[:5])
+    index.save()
+    index.add_batch(ids(10)[5:], data[5:])
+    index.remove(ids(10)[0])
+    
+    reloaded = make_index(tmp_path)
+    assert reloaded.count == 9
+    assert reloaded.get_embedding(ids(10)[0]) is None
+    assert nearest(reloaded, data[7]) == ids(10)[7]
+
+
+def test_journal_replay_is_idempotent(tmp_path):
+    index = make_index(tmp_path)
+    index.add_batch(ids(5), vectors(5))
+    journal = index.journal_path.read_bytes()
+    index.save()
+    # As after a crash between the snapshot and the journal truncation
+    index.journal_path.write_bytes(journal)
+    
+    reloaded = make_index(tmp_path)
+    assert reloaded.count == 5
+    assert len(reloaded.id_map) == 5
+
+
+def test_torn_journal_tail_is_dropped(tmp_path):
+    index = make_index(tmp_path)
+    data = vectors(3)
+    index.add_batch(ids(3), data)
+    complete = index.journal_path.stat().st_size
+    with open(index.journal_path, "ab") as f:
+        f.write(b"A\x05\x00\x00\x00partial")
+    
+    reloaded = make_index(tmp_path)
+    assert reloaded.count == 3
+    assert index.journal_path.stat().st_size == complete
+
+
+def test_reset_replaces_contents(tmp_path):
+    index = make_index(tmp_path)
+    index.add_batch(ids(5), vectors(5))
+    data = vectors(3, seed=1)
+    index.reset(["x", "y", "z"], data)
+    
+    reloaded = make_index(tmp_path)
+    assert reloaded.count == 3
+    assert nearest(reloaded, data[1]) == "y"
+
+
+def test_journal_not_replayed_after_failed_snapshot_load(tmp_path):
+    index = make_index(tmp_path)
+    index.add_batch(ids(5), vectors(5))
+    index.save()
+    index.add("late", vectors(1, seed=1)[0])
+    index.index_path.write_bytes(b"not an index")
+    
+    reloaded = make_index(tmp_path)
+    # Replaying only the changes since the snapshot would give a partial
+    # index that the next save writes out as complete
+    assert reloaded.count == 0
+    assert not reloaded.journal_path.exists()
+    assert reloaded.journal_path.with_suffix(".wal.orphaned").exists()